@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from mutagen.flac import FLAC
+
+data_dir  = os.path.join(
+  os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'),
+  'music-tag'
+)
+done_file = os.path.join(data_dir, 'compressed.sqlite') # files already tried
+flac_args = ['--best', '--exhaustive-model-search', '--verify']
+
+def done_db():
+  os.makedirs(data_dir, exist_ok=True)
+  db = sqlite3.connect(done_file)
+  db.execute('''CREATE TABLE IF NOT EXISTS done (
+                  path  TEXT PRIMARY KEY,
+                  size  INTEGER,
+                  mtime INTEGER
+                )'''
+  )
+  return db
+
+def stat_key(path):
+  st = os.stat(path)
+  return st.st_size, st.st_mtime_ns
+
+def is_done(db, path):
+  row = db.execute('SELECT size, mtime FROM done WHERE path=?', (path,))
+  return row.fetchone() == stat_key(path)
+
+def mark_done(db, path):
+  db.execute('INSERT OR REPLACE INTO done VALUES (?, ?, ?)',
+             (path, *stat_key(path))
+  )
+  db.commit()
+
+def find_flacs(paths):
+  for path in paths:
+    if os.path.isfile(path):
+      yield os.path.realpath(path)
+      continue
+    for dirpath, dirnames, filenames in os.walk(path):
+      dirnames.sort()
+      for name in sorted(filenames):
+        if name.lower().endswith('.flac'):
+          yield os.path.realpath(os.path.join(dirpath, name))
+
+def metadata(f):
+  # what music-tag.py writes (tags and pictures) plus the audio checksum
+  return (sorted(f.tags or []),
+          [(p.type, p.mime, p.desc, p.data) for p in f.pictures],
+          f.info.md5_signature
+  )
+
+def restore_metadata(orig, filename):
+  # flac normally carries everything over, put it back if it did not
+  f = FLAC(filename)
+  if f.tags is None:
+    f.add_tags()
+  f.tags.clear()
+  f.tags.extend(orig.tags or [])
+  f.clear_pictures()
+  for picture in orig.pictures:
+    f.add_picture(picture)
+  f.save()
+
+def compress(path):
+  # re-encode next to the original so the replace is a rename on one disk
+  dirname, name = os.path.split(path)
+  fd, tmp = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=dirname)
+  os.close(fd)
+  try:
+    subprocess.run(['flac', *flac_args, '-s', '-f', '-o', tmp, path],
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, check=True
+    )
+    old = os.stat(path).st_size
+    if os.stat(tmp).st_size >= old:
+      return 'ignoring', old, old
+    orig = FLAC(path)
+    if metadata(orig) != metadata(FLAC(tmp)):
+      restore_metadata(orig, tmp)
+      if metadata(orig) != metadata(FLAC(tmp)):
+        return 'tags differ, ignoring', old, old
+    new = os.stat(tmp).st_size
+    if new >= old:
+      return 'ignoring', old, old
+    shutil.copymode(path, tmp)
+    os.replace(tmp, path)
+    return 'replacing', old, new
+  except (OSError, subprocess.CalledProcessError) as e:
+    return f'failed ({e})', 0, 0
+  finally:
+    if os.path.exists(tmp):
+      os.remove(tmp)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='recompress flac files')
+  parser.add_argument('paths', nargs='*', metavar='path',
+                      default=[os.path.expanduser('~/Music')],
+                      help='files or directories (default ~/Music)'
+  )
+  parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                      help='files to compress at once'
+  )
+  parser.add_argument('-f', '--force', action='store_true',
+                      help='also retry files that were compressed before'
+  )
+  args = parser.parse_args()
+  if not shutil.which('flac'):
+    sys.exit('flac is not installed')
+
+  db    = done_db()
+  files = [f for f in find_flacs(args.paths) if args.force or not is_done(db, f)]
+  saved = 0
+  # the work happens in the flac processes, threads are enough to drive them
+  with ThreadPoolExecutor(args.jobs) as pool:
+    jobs = {pool.submit(compress, f): f for f in files}
+    for job in as_completed(jobs):
+      path = jobs[job]
+      status, old, new = job.result()
+      print(f'{path} - {status}')
+      if not status.startswith('failed'):
+        mark_done(db, path)
+        saved += old - new
+  print(f'{len(files)} files, saved {saved / 1024 / 1024:.1f} MiB')
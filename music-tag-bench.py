@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import shutil
+import struct
+import random
+import atexit
+import argparse
+import tempfile
+import threading
+import statistics
+import contextlib
+import http.server
+import urllib.parse
+from unidecode import unidecode
+from mutagen.id3 import ID3, TALB, TIT2
+
+here    = os.path.dirname(os.path.realpath(__file__))
+history = os.path.join(
+  os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'),
+  'music-tag', 'bench.json'
+)
+
+# music-tag.py keeps its cache, library index and mirror in the xdg dirs,
+# point those at a scratch dir so every run starts cold and leaves nothing
+work = tempfile.mkdtemp(prefix='music-tag-bench-')
+atexit.register(shutil.rmtree, work, True)
+for name in ('XDG_CACHE_HOME', 'XDG_DATA_HOME', 'XDG_CONFIG_HOME'):
+  os.environ[name] = os.path.join(work, name.lower())
+
+sys.path.insert(0, here)
+import music_tag as mt
+
+# the regex chains music-tag.py used before clean_orig()/clean_latin(),
+# kept here as the reference their output is checked against
+pats0 = [
+  (re.compile('、\\s*'), ', '),
+  (re.compile('！'),      '!'),
+  (re.compile('＆'),      '&'),
+  (re.compile('…'),     '...'),
+  (re.compile('～'),      '~'),
+  (re.compile('’'),       "'")
+]
+
+pats1 = [
+  (
+   re.compile(
+    r'\s+[<\[\(-](orig)?(inal)?\s*(off vocals?|instr?(umental)?|kara(oke)?)(\s+ver)?(sion)?\.?[\]\)>-]',
+    re.I
+   ), ' -instrumental-'
+  ),
+  (re.compile('\\s+-$'), '-'),
+  (re.compile('[\"\'~\\[\\]\\(\\)=\\+\\*<>:]'), '-'),
+  (re.compile(r'[^\.A-Za-z0-9 -]'),             ' '),
+  (re.compile(r'\s+'),                          ' '),
+  (re.compile('\\s+-$'),                        '-'),
+  (re.compile(r'\s*\.*(\.[a-z]{2,5})$', re.I),  r'\1')
+]
+
+def old_orig(text):
+  for pat, rep in pats0:
+    text = pat.sub(rep, text)
+  return text
+
+def old_latin(text):
+  text = unidecode(text)
+  for pat, rep in pats1:
+    text = pat.sub(rep, text)
+  return text
+
+pieces = [
+  'Kimi no Na wa', '君の名は', 'ハレ晴レユカイ', '恋愛サーキュレーション', 'Ｌｏｖｅ',
+  ' (Off Vocal)', ' [Instrumental]', ' -karaoke-', ' <Original Karaoke Ver.>',
+  ' (instr.)', ' (TV size)', '、 ', '！', '＆', '…', '～', '’', ' - ', ' -',
+  '  ', '\t', '"quoted"', "it's", '~wave~', '[Disc 1]', 'a=b+c*d', ':',
+  '01 ', '02_', '03.', ' .flac', '.mp3', '..ogg', ' .FLAC', 'x.y', '♪', '★',
+  'Ä', 'é', 'ß', '/', '\\', '?', '#', '-'
+]
+
+def corpus(count, seed=0):
+  rand = random.Random(seed)
+  return [''.join(rand.choice(pieces) for i in range(rand.randint(1, 8)))
+          for i in range(count)
+  ]
+
+def timeit(func, items, repeat=3):
+  best = None
+  for i in range(repeat):
+    if hasattr(func, 'cache_clear'):
+      func.cache_clear()
+    start = time.perf_counter()
+    for item in items:
+      func(item)
+    took = time.perf_counter() - start
+    best = took if best is None else min(best, took)
+  return best
+
+def bench_normalize(count):
+  items = corpus(count)
+  bad   = 0
+  for old, new in ((old_orig, mt.clean_orig), (old_latin, mt.clean_latin)):
+    for item in items:
+      if old(item) != new(item):
+        bad += 1
+        print(f'mismatch {new.__name__}({item!r}): {old(item)!r} != {new(item)!r}')
+
+  # library names repeat a lot (album names on every track, reruns), so
+  # time a list where every name shows up a few times too
+  repeated = (items[:1000] * (count//1000 + 1))[:count]
+  results  = {}
+  for name, old, new in (('orig',  old_orig,  mt.clean_orig),
+                         ('latin', old_latin, mt.clean_latin)):
+    results[f'{name} chain']          = timeit(old, items)
+    results[f'{name} compiled']       = timeit(new.__wrapped__, items)
+    results[f'{name} chain, repeats'] = timeit(old, repeated)
+    results[f'{name} memo, repeats']  = timeit(new, repeated)
+  for name, took in results.items():
+    print(f'{name:24} {took*1e6/count:8.2f} us/name')
+  return bad, {f'clean_{name}': took / count for name, took in results.items()}
+
+def png(width=64, height=64):
+  # a small valid cover, so Pillow has something to scale
+  def chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + \
+           struct.pack('>I', zlib.crc32(kind + data))
+  rows = b''.join(b'\0' + bytes([x % 256, 0, 128]) * width for x in range(height))
+  return b'\x89PNG\r\n\x1a\n' + \
+         chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+         chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
+
+def make_fixtures(albums, tracks):
+  # url path -> response, shaped like vocadb, vgmdb.info and mal; @SERVER@
+  # becomes the stand-in server's url when it is served
+  fixtures = {}
+  for i in range(albums):
+    name = f'Bench Album {i}'
+    fixtures[f'/api/albums/{i}'] = {
+      'id'           : i,
+      'defaultName'  : name,
+      'name'         : name,
+      'description'  : '',
+      'mainPicture'  : {'urlThumb':f'@SERVER@Album/CoverPicture/{i}'},
+      'releaseDate'  : {'year':2020, 'month':1, 'day':2},
+      'tags'         : [{'tag':{'name':'J-Pop'}}],
+      'artists'      : [{'categories':'Vocalist', 'artist':{'id':a}}
+                        for a in range(4)
+      ],
+      'tracks'       : [{'discNumber':1, 'trackNumber':n+1, 'song':{
+                          'defaultName'  : f'曲 {i}-{n}',
+                          'name'         : f'Kyoku {i}-{n} (Off Vocal)',
+                          'lengthSeconds': 1,
+                          'artists'      : [{'categories':'Vocalist',
+                                             'artist':{'id':n % 4}}]
+                        }} for n in range(tracks)
+      ]
+    }
+    fixtures[f'/vgmdb/album/{i}'] = {
+      'link'         : f'album/{i}',
+      'name'         : name,
+      'names'        : {'ja':f'{name} / x', 'ja-latn':f'{name} / x'},
+      'notes'        : 'Vocals by Chara (CV: Singer 0) and Other (CV: Singer 1)',
+      'release_date' : '2020-01-02',
+      'picture_full' : f'@SERVER@Album/CoverPicture/{i}',
+      'picture_small': '',
+      'picture_thumb': '',
+      'categories'   : ['Animation'],
+      'covers'       : [],
+      'performers'   : [{'names':{'en':f'Singer {a}', 'ja':f'歌手{a}'}}
+                        for a in range(2)
+      ],
+      'discs'        : [{'tracks':[{'names':{'Japanese':f'曲 {i}-{n}',
+                                             'Romaji':f'Kyoku {i}-{n}'},
+                                    'track_length':'0:01'}
+                                   for n in range(tracks)
+      ]}]
+    }
+    fixtures[f'/Album/CoverPicture/{i}'] = png()
+  for a in range(4):
+    fixtures[f'/api/artists/{a}'] = {'id':a, 'defaultName':f'歌手{a}',
+                                     'categories':'Vocalist'
+    }
+  fixtures['/character.php'] = '<table><tr><td>' \
+    '<a href="character/1/Chara">Chara</a></td></tr></table>'
+  fixtures['/character/1/Chara'] = '<div class="normal_header"><span>' \
+    'Chara <small>(キャラ)</small></span></div>'
+  return {path: data if type(data) == bytes else
+                data.encode() if type(data) == str else
+                json.dumps(data).encode()
+          for path, data in fixtures.items()
+  }
+
+def save_fixtures(fixtures, dirname):
+  os.makedirs(dirname, exist_ok=True)
+  for path, data in fixtures.items():
+    with open(os.path.join(dirname, urllib.parse.quote(path, safe='')), 'wb') as f:
+      f.write(data)
+
+def load_fixtures(dirname):
+  # recorded responses, one file per url path (see --save-fixtures)
+  fixtures = {}
+  for name in os.listdir(dirname):
+    with open(os.path.join(dirname, name), 'rb') as f:
+      fixtures[urllib.parse.unquote(name)] = f.read()
+  return fixtures
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+  fixtures = {}
+  server_url = ''
+
+  def do_GET(self):
+    url    = urllib.parse.urlsplit(self.path)
+    params = urllib.parse.parse_qs(url.query)
+    if url.path.startswith('/utaitedb/'): # nothing on the utaite side
+      return self.reply(200, b'{"items": []}')
+    if url.path.rstrip('/') == '/api/albums':
+      terms = params.get('query', [''])[0].lower()
+      items = [json.loads(data) for path, data in self.fixtures.items()
+               if re.match('^/api/albums/\\d+$', path)
+      ]
+      items = [{'id':a['id'], 'defaultName':a['defaultName'], 'name':a['name']}
+               for a in items if terms in a['defaultName'].lower()
+      ]
+      return self.reply(200, json.dumps({'items':items[:10]}).encode())
+    data = self.fixtures.get(url.path)
+    if data is None:
+      return self.reply(404, b'{}')
+    self.reply(200, data.replace(b'@SERVER@', self.server_url.encode()))
+
+  def reply(self, status, body):
+    self.send_response(status)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+def serve(fixtures):
+  server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+  FixtureHandler.fixtures   = fixtures
+  FixtureHandler.server_url = f'http://127.0.0.1:{server.server_port}/'
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return FixtureHandler.server_url
+
+def use_server(url):
+  # every lookup music-tag.py makes goes to the stand-in server; pyvgmdb can
+  # not be pointed anywhere, so vgmdb albums are replayed through fetch()
+  def get_album_vgmdb(album_id):
+    data = mt.fetch(f'{url}vgmdb/album/{album_id}', key=f'vgmdb:album:{album_id}')
+    return mt.vgmdb_album(json.loads(data)) if data else None
+  mt.vocadb_url       = url
+  mt.utaitedb_url     = url + 'utaitedb/'
+  mt.mal_url          = url
+  mt.search_vgmdb     = lambda terms: []
+  mt.get_album_vgmdb  = get_album_vgmdb
+  mt.batch            = True
+  mt.gain             = False
+  mt.print_workers    = 1
+
+def flac_file(path, tags, seconds=1, rate=44100):
+  # just the metadata blocks; mutagen and the header reader need no audio
+  info = rate << 44 | 1 << 41 | 15 << 36 | rate * seconds
+  si   = struct.pack('>HH', 4096, 4096) + b'\0' * 6 + info.to_bytes(8, 'big') + \
+         b'\0' * 16
+  vendor   = b'music-tag-bench'
+  comments = [f'{k.upper()}={v}'.encode() for k,v in tags.items()]
+  vc   = struct.pack('<I', len(vendor)) + vendor + \
+         struct.pack('<I', len(comments)) + \
+         b''.join(struct.pack('<I', len(c)) + c for c in comments)
+  with open(path, 'wb') as f:
+    f.write(b'fLaC' + b'\0' + len(si).to_bytes(3, 'big') + si +
+            b'\x04' + len(vc).to_bytes(3, 'big') + vc +
+            b'\x81' + (1024).to_bytes(3, 'big') + b'\0' * 1024
+    )
+
+def mp3_file(path, tags):
+  frame = bytes([0xff, 0xfb, 0x90, 0x64]) + b'\0' * 413
+  with open(path, 'wb') as f:
+    f.write(frame * 40)
+  id3 = ID3()
+  id3.add(TALB(encoding=3, text=tags['album']))
+  id3.add(TIT2(encoding=3, text=tags['title']))
+  id3.save(path)
+
+def make_tree(root, albums, tracks):
+  # half flac, half mp3 albums, tagged with the names the fixtures use
+  dirnames = []
+  for i in range(albums):
+    dirname = os.path.join(root, f'album{i:03}')
+    os.makedirs(dirname)
+    for n in range(tracks):
+      tags = {'album':f'Bench Album {i}', 'title':f'曲 {i}-{n}'}
+      if i % 2:
+        mp3_file(os.path.join(dirname, f'{n+1:02} track {n}.mp3'), tags)
+      else:
+        flac_file(os.path.join(dirname, f'{n+1:02} track {n}.flac'), tags)
+    dirnames.append(dirname)
+  return dirnames
+
+def reset_caches():
+  with mt._cache_lock:
+    mt.cache_db().execute('DELETE FROM http')
+    mt.cache_db().commit()
+  mt.vocadb_artists.clear()
+  mt.charnames.clear()
+  mt.images.clear()
+
+def each(func, items):
+  start = time.perf_counter()
+  for item in items:
+    func(item)
+  return (time.perf_counter() - start) / max(len(items), 1)
+
+def bench_lookups(url, albums):
+  results = {}
+  ids     = list(range(albums))
+  for name, get in (('get_info_vocadb', lambda i: mt.get_info_vocadb(i, url)),
+                    ('get_info_vgmdb',  mt.get_info_vgmdb)):
+    reset_caches()
+    results[f'{name} cold'] = each(get, ids)
+    results[f'{name} warm'] = each(get, ids)
+  return results
+
+def bench_scan(root, albums, tracks):
+  dirnames = make_tree(root, albums, tracks)
+  best = min(each(mt.scan_album, dirnames) for i in range(3))
+  return {'scan_album': best}
+
+def bench_write(root, albums, tracks):
+  dirnames = make_tree(root, albums, tracks)
+  cover    = mt.normalize_cover(png(600, 600))
+  files    = [os.path.join(d, f) for d in dirnames for f in sorted(os.listdir(d))]
+  info     = {'title':'曲', 'album_name_orig':'Bench Album', 'artist':'歌手',
+              'genre':'J-Pop', 'comment':'', 'date':'2020-01-02',
+              'album_artists':'歌手', 'index':1, 'num_songs':tracks,
+              'disc_num':1, 'num_discs':1
+  }
+  def write(filename):
+    f = mt.open_tags(filename)
+    mt.add_pic(f, cover)
+    mt.save_song(f, info)
+  return {'add_pic+save_song': each(write, files)}
+
+def bench_albums(root, albums, tracks):
+  dirnames = make_tree(root, albums, tracks)
+  reset_caches()
+  with contextlib.redirect_stdout(io.StringIO()):
+    took = each(mt.process_album, dirnames)
+  tagged = mt.library_db().execute('SELECT COUNT(*) FROM albums').fetchone()[0]
+  if tagged < albums:
+    print(f'only {tagged}/{albums} albums were matched and written')
+  return {'process_album': took}
+
+def record(results, filename, tolerance, size, keep=20):
+  # anything slower than the median of the earlier runs of the same size is
+  # a regression
+  runs = []
+  if os.path.exists(filename):
+    with open(filename) as f:
+      runs = json.load(f).get('runs', [])
+  slower = []
+  for name, took in results.items():
+    old = [run['results'][name] for run in runs
+           if name in run['results'] and run.get('size') == size
+    ]
+    if old and took > statistics.median(old) * (1 + tolerance):
+      slower.append(name)
+      print(f'regression: {name} {took*1e3:.3f} ms, '
+            f'median of {len(old)} runs {statistics.median(old)*1e3:.3f} ms'
+      )
+  runs = (runs + [{'time':time.time(), 'size':size, 'results':results}])[-keep:]
+  os.makedirs(os.path.dirname(filename), exist_ok=True)
+  with open(filename, 'w') as f:
+    json.dump({'runs':runs}, f, indent=2)
+  return slower
+
+if __name__ == '__main__':
+  benches = ('normalize', 'lookups', 'scan', 'write', 'albums')
+  parser  = argparse.ArgumentParser(description='music-tag.py benchmarks')
+  parser.add_argument('only', nargs='*', metavar='bench',
+                      help=f'which ones to run ({", ".join(benches)})'
+  )
+  parser.add_argument('-n', '--count', type=int, default=20000,
+                      help='number of generated names'
+  )
+  parser.add_argument('-a', '--albums', type=int, default=20,
+                      help='albums in the generated library'
+  )
+  parser.add_argument('-t', '--tracks', type=int, default=12,
+                      help='tracks per generated album'
+  )
+  parser.add_argument('--fixtures', metavar='DIR',
+                      help='replay these recorded responses instead'
+  )
+  parser.add_argument('--save-fixtures', metavar='DIR',
+                      help='write the generated responses to DIR and exit'
+  )
+  parser.add_argument('--history', default=history, metavar='FILE',
+                      help=f'where results are kept (default {history})'
+  )
+  parser.add_argument('--tolerance', type=float, default=0.2,
+                      help='how much slower than usual counts as a regression'
+  )
+  parser.add_argument('--no-record', action='store_true',
+                      help='do not add this run to the history'
+  )
+  args = parser.parse_args()
+  only = args.only or benches
+  if set(only) - set(benches):
+    parser.error(f'unknown benchmark {", ".join(set(only) - set(benches))}')
+
+  fixtures = make_fixtures(args.albums, args.tracks)
+  if args.save_fixtures:
+    save_fixtures(fixtures, args.save_fixtures)
+    sys.exit()
+  if args.fixtures:
+    fixtures = load_fixtures(args.fixtures)
+  use_server(serve(fixtures))
+
+  bad     = 0
+  results = {}
+  if 'normalize' in only:
+    bad, found = bench_normalize(args.count)
+    results.update(found)
+  if 'lookups' in only:
+    results.update(bench_lookups(mt.vocadb_url, args.albums))
+  for name, bench in (('scan',   bench_scan),
+                      ('write',  bench_write),
+                      ('albums', bench_albums)):
+    if name in only:
+      results.update(bench(tempfile.mkdtemp(dir=work), args.albums, args.tracks))
+
+  for name, took in results.items():
+    if not name.startswith('clean_'):
+      print(f'{name:24} {took*1e3:8.3f} ms/item')
+  slower = [] if args.no_record else \
+           record(results, args.history, args.tolerance,
+                  [args.count, args.albums, args.tracks]
+           )
+  sys.exit(1 if bad or slower else 0)
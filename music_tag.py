@@ -0,0 +1,2887 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import base64
+import struct
+import re
+import sys
+import copy
+import glob
+import json
+import time
+import pickle
+import hashlib
+import functools
+import contextlib
+import collections
+import random
+import queue
+import argparse
+import threading
+import importlib.util
+from itertools import islice, zip_longest
+try:
+  import gnureadline as readline
+except:
+  import readline
+import tempfile
+import shutil
+import urllib.parse
+import types
+
+class LazyModule(types.ModuleType):
+  # stands in for a module until something in it is first used, so tagging
+  # one file does not pay for the network and numeric libraries. the import
+  # system's own locks make that first use safe from several threads.
+  # submodules load the same way, mutagen.flac on the first mutagen.flac.FLAC
+  def __getattr__(self, attr):
+    module = importlib.import_module(self.__name__)
+    if not hasattr(module, attr) and hasattr(module, '__path__'):
+      with contextlib.suppress(ModuleNotFoundError):
+        importlib.import_module(f'{self.__name__}.{attr}')
+    self.__dict__.update(vars(module))
+    return getattr(module, attr)
+
+def lazy_import(name):
+  # None if it is not installed
+  try:
+    spec = importlib.util.find_spec(name)
+  except ImportError:
+    spec = None
+  return LazyModule(name) if spec else None
+
+mutagen   = lazy_import('mutagen')
+unidecode = lazy_import('unidecode')
+requests  = lazy_import('requests')
+natsort   = lazy_import('natsort')
+Image     = lazy_import('PIL.Image') # optional, for cover resizing
+numpy     = lazy_import('numpy')     # optional, for fingerprints and replaygain
+# standard ones that only some runs use
+sqlite3         = lazy_import('sqlite3')
+difflib         = lazy_import('difflib')
+socket          = lazy_import('socket')
+cProfile        = lazy_import('cProfile')
+multiprocessing = lazy_import('multiprocessing')
+subprocess      = lazy_import('subprocess')
+traceback       = lazy_import('traceback')
+futures         = lazy_import('concurrent.futures')
+
+#import pdb
+#import pprint ; pp = pprint.PrettyPrinter(indent=2)
+
+class CharMap(dict):
+  # str.translate() table, characters that are not listed map to `default`
+  def __init__(self, table, default):
+    super().__init__(table)
+    self.default = default
+
+  def __missing__(self, key):
+    self[key] = self.default
+    return self.default
+
+class Memo(collections.OrderedDict):
+  # keeps the `size` most recently used entries, safe to share with threads
+  def __init__(self, size):
+    super().__init__()
+    self.size = size
+    self.lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self.lock:
+      if key not in self:
+        return default
+      self.move_to_end(key)
+      return self[key]
+
+  def put(self, key, value):
+    with self.lock:
+      self[key] = value
+      self.move_to_end(key)
+      while len(self) > self.size:
+        self.popitem(last=False)
+
+# original names: "、" separators and full width punctuation, in one pass
+orig_chars = {'！':'!', '＆':'&', '…':'...', '～':'~', '’':"'"}
+orig_pat   = re.compile('、\\s*|[！＆…～’]')
+
+# latin names/filenames: the old 7 step regex chain, reduced to two
+# substitutions, a character map and one more substitution for spaces, with
+# the extension handled by hand at the end of the string
+latin_instr  = re.compile(
+  r'\s+[<\[\(-](orig)?(inal)?\s*(off vocals?|instr?(umental)?|kara(oke)?)'
+  r'(\s+ver)?(sion)?\.?[\]\)>-]',
+  re.I
+)
+latin_dash   = re.compile(r'\s+-$')
+latin_chars  = CharMap(
+  {ord(c): c for c in '.- abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                      '0123456789'} |
+  {ord(c): '-' for c in '"\'~[]()=+*<>:'},
+  ' '
+)
+latin_spaces = re.compile(' {2,}')
+latin_ext    = re.compile(r'\.[a-z]{2,5}$', re.I)
+
+genre_reps = {
+  'Talk'      : 'Drama',
+  'Animation' : 'Anime',
+  'pop'       : '',
+  'pop rock'  : '',
+  'rock'      : 'Rock',
+  'J-pop'     : 'JPop'
+}
+
+# a name containing the pattern becomes the alias. user entries from
+# alias_file come first; where several match, the one that starts first in
+# the name wins, then the one listed first
+artist_reps = [
+  ('MEIKO',               'メイコ'),
+  ('GUMI',                  'グミ'),
+  ('Megpoid',       'メグッポイド'),
+  ('KAITO',               'カイト'),
+  ('Gackpoid',      'がくっぽいど'),
+  ('^(イア,?\\s+)?IA',        'イア'),
+  ('Camui Gackpo',    '神威がくぽ')
+]
+
+char_reps = {
+  'Hazime': 'Hajime',
+  'Iizima': 'Iijima',
+}
+
+default = {
+  'album_name_orig'  : '',
+  'album_name_latin' : '',
+  'source'           : 'none',
+  'url'              : '',
+  'cover'            : '',
+  'thumb'            : '',
+  'notes'            : '',
+  'date'             : '',
+  'genres'           : [],
+  'discs'            : [],
+  'artists'          : []
+}
+
+charnames      = {}
+vocadb_artists = {}
+written        = {} # filename -> tags, for the album being written
+plan_images    = {} # image hash -> base64, embedded in the plan
+plan_album     = None
+images         = Memo(16) # url -> image bytes, the last few albums' art
+pictures       = Memo(8)  # (image hash, tag type) -> picture frame
+
+fetch_workers  = 12
+lookup_workers = 4
+source_timeout = 20
+max_candidates = 10
+
+cache_dir  = os.path.join(
+  os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+  'music-tag'
+)
+cache_ttl  = 30 * 24 * 3600 # albums, artists and characters
+search_ttl = 24 * 3600
+cache_size = 256 * 1024 * 1024
+offline    = False
+
+vocadb_url   = 'https://vocadb.net/'
+utaitedb_url = 'http://utaitedb.net/'
+mal_url      = 'https://myanimelist.net/'
+
+http_timeout = 10
+http_retries = 3
+http_backoff = 1.0 # seconds, doubled on each retry
+http_rates   = { # minimum seconds between requests to a host
+  'myanimelist.net' : 1.2,
+  'vocadb.net'      : 0.2,
+  'utaitedb.net'    : 0.2
+}
+
+data_dir    = os.path.join(
+  os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'),
+  'music-tag'
+)
+config_dir  = os.path.join(
+  os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config'),
+  'music-tag'
+)
+alias_file  = os.path.join(config_dir, 'artists.json') # {"pattern": "alias"}
+review_file = os.path.join(data_dir, 'review.txt')
+image_dir   = os.path.join(cache_dir, 'images')
+library     = os.path.join(data_dir, 'library.sqlite')
+mirror      = os.path.join(data_dir, 'mirror.sqlite') # imported album dumps
+daemon_sock = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or cache_dir,
+                           'music-tag.sock'
+)
+force       = False # retag albums the library index says are done
+plan        = None  # when planning (--plan) writes are recorded here instead
+
+tag_padding       = 4096 # room left for later edits when a tag has to grow
+
+cover_size        = 600 # embedded art is scaled to fit this (needs Pillow)
+cover_quality     = 85
+cover_progressive = True
+
+image_types = [ # magic bytes -> mimetype, extension
+  (b'\xff\xd8\xff',         'image/jpeg', '.jpg'),
+  (b'\x89PNG\r\n\x1a\n', 'image/png',  '.png'),
+  (b'GIF8',                 'image/gif',  '.gif'),
+  (b'BM',                   'image/bmp',  '.bmp')
+]
+
+print_rate    = 11025 # fingerprints are taken from the start of the track,
+print_seconds = 90    # as mono audio at this rate
+print_frame   = 4096
+print_hop     = 2048
+print_smooth  = 4     # frames averaged, so a slightly shifted rip still fits
+print_match   = 0.75  # share of equal bits for two prints to be the same song
+print_workers = os.cpu_count()
+ffmpeg        = shutil.which('ffmpeg')
+
+gain           = True  # replaygain tags (needs numpy and ffmpeg)
+gain_rate      = 48000 # the k-weighting filter is defined at this rate
+gain_reference = -18   # LUFS, replaygain 2.0
+gain_workers   = os.cpu_count()
+k_filter       = [ # (b, a) biquads from bs.1770
+  ((1.53512485958697, -2.69169618940638, 1.19839281085285),
+   (1.0, -1.69065929318241, 0.73248077421585)),
+  ((1.0, -2.0, 1.0),
+   (1.0, -1.99004745483398, 0.99007225036621))
+]
+
+batch          = False # never prompt, take the defaults
+min_confidence = 0.6   # below this --batch leaves the album for --review
+prefetch_ahead = 2     # albums looked up in the background while prompting
+auto_accept    = 0.9   # take the best match without asking when it is this
+auto_margin    = 0.15  # good and this far ahead of the next one
+length_slack   = 10    # seconds off before a track length counts as wrong
+
+def wave_tags(filename):
+  # wav keeps an ID3 tag in a RIFF chunk, wrap it so it works like EasyID3
+  audio = mutagen.wave.WAVE(filename)
+  if audio.tags is None:
+    audio.add_tags()
+    audio.tags.filename = filename
+  tags = mutagen.easyid3.EasyID3()
+  tags._EasyID3__id3 = audio.tags
+  return tags
+
+formats = { # extension -> tag loader, mutagen is loaded by the first one
+  'flac' : lambda filename: mutagen.flac.FLAC(filename),
+  'mp3'  : lambda filename: mutagen.easyid3.EasyID3(filename),
+  'ogg'  : lambda filename: mutagen.oggvorbis.OggVorbis(filename),
+  'opus' : lambda filename: mutagen.oggopus.OggOpus(filename),
+  'm4a'  : lambda filename: mutagen.easymp4.EasyMP4(filename),
+  'wav'  : wave_tags
+}
+
+@functools.lru_cache(maxsize=None)
+def easy_keys():
+  # tags the easy wrappers do not know, registered before the first file
+  easyid3 = mutagen.easyid3.EasyID3
+  easyid3.RegisterTextKey('comment', 'COMM')
+  for key in ('track_gain', 'track_peak', 'album_gain', 'album_peak'):
+    # most players read these, not the RVA2 frames easyid3 maps them to
+    easyid3.RegisterTXXXKey(f'replaygain_{key}', f'REPLAYGAIN_{key.upper()}')
+    mutagen.easymp4.EasyMP4Tags.RegisterFreeformKey(f'replaygain_{key}',
+                                                    f'REPLAYGAIN_{key.upper()}'
+    )
+
+_cache_db   = None
+_library_db = None
+_mirror_db  = None
+_mirror_lock = threading.Lock()
+_aliases    = None
+_alias_lock = threading.Lock()
+_cache_lock = threading.Lock()
+_cache_used  = {}   # key -> time of the hits not written yet
+_cache_total = None # bytes in the cache
+_session    = None
+_host_next  = {}
+_http_lock  = threading.Lock()
+_stats_lock = threading.Lock()
+
+timings  = {} # phase -> [calls, seconds]
+counters = collections.Counter() # requests/bytes per host, cache hits
+trace    = None # chrome trace events, when --trace is given
+
+def read(prompt, default=''):
+  if batch:
+    return default
+  if isinstance(sys.stdin, RemoteIO): # a run in the --daemon
+    return sys.stdin.ask(prompt, default)
+  prompt = '\r'+prompt
+  def insert_default():
+    readline.insert_text(default)
+    readline.redisplay()
+  while True:
+    try:
+      text = input(prompt)
+      readline.set_pre_input_hook(None)
+      return text or default
+    except EOFError:
+      readline.set_pre_input_hook(insert_default)
+
+def to_gen(func, *args, **kwargs):
+  try:
+    for elem in func(*args, **kwargs):
+      yield elem
+  except:
+    pass
+
+@contextlib.contextmanager
+def timer(phase):
+  wall  = time.time()
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    took = time.perf_counter() - start
+    with _stats_lock:
+      timings.setdefault(phase, [0, 0.0])
+      timings[phase][0] += 1
+      timings[phase][1] += took
+      if trace is not None:
+        trace.append({'name':phase, 'ph':'X', 'ts':wall * 1e6,
+                      'dur':took * 1e6, 'pid':os.getpid(),
+                      'tid':threading.get_ident()
+        })
+
+def timed(phase):
+  def wrap(func):
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+      with timer(phase):
+        return func(*args, **kwargs)
+    return run
+  return wrap
+
+def count(name, n=1):
+  with _stats_lock:
+    counters[name] += n
+
+def take_stats():
+  # hands a --jobs worker's numbers to the parent and starts over
+  with _stats_lock:
+    taken = {'timings':dict(timings), 'counters':dict(counters),
+             'trace':list(trace or [])
+    }
+    timings.clear()
+    counters.clear()
+    if trace is not None:
+      trace.clear()
+  return taken
+
+def merge_stats(taken):
+  with _stats_lock:
+    for phase, (n, took) in taken['timings'].items():
+      timings.setdefault(phase, [0, 0.0])
+      timings[phase][0] += n
+      timings[phase][1] += took
+    counters.update(taken['counters'])
+    if trace is not None:
+      trace.extend(taken['trace'])
+
+def print_stats():
+  # times include the phases run inside them (get_info_* includes artists)
+  print(f"\n{'phase':<20} {'calls':>6} {'total':>9} {'mean':>9}")
+  for phase, (n, took) in sorted(timings.items(), key=lambda x: -x[1][1]):
+    print(f'{phase:<20} {n:>6} {took:>8.2f}s {took / n * 1000:>7.1f}ms')
+  hosts = sorted({k.rpartition(' ')[0] for k in counters if k.endswith(' requests')})
+  if hosts:
+    print(f"\n{'host':<28} {'requests':>8} {'bytes':>12}")
+  for host in hosts:
+    print(f"{host:<28} {counters[host+' requests']:>8} "
+          f"{counters[host+' bytes']:>12}"
+    )
+  hits  = counters['cache hit'] + counters['cache revalidated']
+  total = hits + counters['cache stale'] + counters['cache miss']
+  if total:
+    print(f"\ncache hits: {hits}/{total} ({hits / total:.0%}, "
+          f"{counters['cache revalidated']} revalidated, "
+          f"{counters['cache stale']} stale)"
+    )
+  for stat in ('image', 'character'):
+    hits  = counters[f'{stat} hit']
+    total = hits + counters[f'{stat} miss']
+    if total:
+      print(f'{stat} hits: {hits}/{total} ({hits / total:.0%})')
+
+def save_stats(filename):
+  with open(filename, 'w') as f:
+    json.dump({'timings':timings, 'counters':counters}, f, indent=2)
+
+def save_trace(filename):
+  # chrome://tracing / perfetto format
+  with open(filename, 'w') as f:
+    json.dump({'traceEvents':trace, 'displayTimeUnit':'ms'}, f)
+
+@functools.lru_cache(maxsize=8192)
+def clean_orig(text):
+  return orig_pat.sub(lambda m: orig_chars.get(m.group(0), ', '), text)
+
+@functools.lru_cache(maxsize=8192)
+def clean_latin(text):
+  text = latin_instr.sub(' -instrumental-', unidecode.unidecode(text))
+  text = latin_dash.sub('-', text)
+  text = latin_spaces.sub(' ', text.translate(latin_chars))
+  if text.endswith(' -'):
+    return text[:-2] + '-'
+  ext = latin_ext.search(text, max(0, len(text) - 6))
+  if ext: # drop dots and spaces before the extension
+    text = text[:ext.start()].rstrip('.').rstrip(' ') + ext.group(0)
+  return text
+
+def build_automaton(words):
+  # aho-corasick over the plain text aliases: goto, fail and output tables
+  goto, fail, out = [{}], [0], [[]]
+  for index, word in enumerate(words):
+    node = 0
+    for c in word:
+      if c not in goto[node]:
+        goto.append({})
+        fail.append(0)
+        out.append([])
+        goto[node][c] = len(goto) - 1
+      node = goto[node][c]
+    out[node].append((len(word), index))
+
+  todo = collections.deque(goto[0].values())
+  while todo:
+    node = todo.popleft()
+    for c, child in goto[node].items():
+      todo.append(child)
+      f = fail[node]
+      while f and c not in goto[f]:
+        f = fail[f]
+      fail[child] = goto[f].get(c, 0)
+      out[child] = out[child] + out[fail[child]]
+  return goto, fail, out
+
+def load_aliases():
+  table = []
+  try:
+    with open(alias_file) as f:
+      table = list(json.load(f).items())
+  except FileNotFoundError:
+    pass
+  except (ValueError, AttributeError) as e:
+    print(f'ignoring {alias_file}: {e}')
+  table += artist_reps
+
+  plain   = [(i, pat) for i, (pat, rep) in enumerate(table)
+             if not re.search(r'[.^$*+?{}\[\]\\|()]', pat)
+  ]
+  # each compiled on its own: inline flags and backreferences do not
+  # survive being joined into one alternation
+  regexes = []
+  for i, (pat, rep) in enumerate(table):
+    if (i, pat) in plain:
+      continue
+    try:
+      regexes.append((i, re.compile(pat)))
+    except re.error as e:
+      print(f'ignoring alias "{pat}" in {alias_file}: {e}')
+  return {
+    'names'     : [rep for pat, rep in table],
+    'plain'     : [i for i, pat in plain],
+    'automaton' : build_automaton([pat for i, pat in plain]),
+    'regexes'   : regexes
+  }
+
+@functools.lru_cache(maxsize=4096)
+def artist_alias(name):
+  global _aliases
+  with _alias_lock:
+    if _aliases is None:
+      _aliases = load_aliases()
+  best = None # (start, table index)
+
+  goto, fail, out = _aliases['automaton']
+  node = 0
+  for pos, c in enumerate(name):
+    while node and c not in goto[node]:
+      node = fail[node]
+    node = goto[node].get(c, 0)
+    for length, index in out[node]:
+      match = (pos - length + 1, _aliases['plain'][index])
+      best  = min(best or match, match)
+
+  for index, regex in _aliases['regexes']:
+    match = regex.search(name)
+    if match:
+      match = (match.start(), index)
+      best  = min(best or match, match)
+  return _aliases['names'][best[1]] if best else name
+
+def clean_names(names, latin=False):
+  clean = clean_latin if latin else clean_orig
+  return [clean(name) for name in names]
+
+@functools.lru_cache(maxsize=1024)
+def clean_genre(genre):
+  for pat,rep in genre_reps.items():
+    genre = genre.replace(pat, rep)
+  return genre
+
+@functools.lru_cache(maxsize=1024)
+def clean_char(name):
+  for pat,rep in char_reps.items():
+    name = name.replace(pat, rep)
+  return name
+
+def http_session():
+  global _session
+  with _http_lock:
+    if _session is None:
+      _session = requests.Session()
+      adapter  = requests.adapters.HTTPAdapter(pool_connections=8,
+                                               pool_maxsize=fetch_workers
+      )
+      _session.mount('http://',  adapter)
+      _session.mount('https://', adapter)
+  return _session
+
+def throttle(host):
+  # reserve the host's next free slot, then wait for it outside the lock
+  with _http_lock:
+    now  = time.monotonic()
+    slot = max(now, _host_next.get(host, now))
+    _host_next[host] = slot + http_rates.get(host, 0)
+  if slot > now:
+    time.sleep(slot - now)
+
+def http_get(url, **kwargs):
+  host = urllib.parse.urlsplit(url).hostname or ''
+  host = host[4:] if host.startswith('www.') else host
+  kwargs.setdefault('timeout', http_timeout)
+  for attempt in range(http_retries + 1):
+    throttle(host)
+    wait = http_backoff * 2**attempt * random.uniform(0.5, 1.5)
+    try:
+      r = http_session().get(url, **kwargs)
+      count(f'{host} requests')
+      count(f'{host} bytes', len(r.content))
+      if r.status_code not in (429, 500, 502, 503, 504):
+        return r
+      if r.headers.get('Retry-After', '').isdigit():
+        # no longer than the last backoff, a server asking for hours does
+        # not get to hang the run
+        asked = int(r.headers['Retry-After'])
+        wait  = max(wait, min(asked, http_backoff * 2**http_retries))
+    except (requests.ConnectionError, requests.Timeout):
+      if attempt == http_retries:
+        raise
+    if attempt == http_retries:
+      return r
+    time.sleep(wait)
+
+def cache_db():
+  global _cache_db
+  if _cache_db is None:
+    os.makedirs(cache_dir, exist_ok=True)
+    _cache_db = sqlite3.connect(os.path.join(cache_dir, 'cache.sqlite'),
+                                check_same_thread=False
+    )
+    _cache_db.execute('''CREATE TABLE IF NOT EXISTS http (
+                           key      TEXT PRIMARY KEY,
+                           etag     TEXT,
+                           modified TEXT,
+                           fetched  REAL,
+                           used     REAL,
+                           size     INTEGER,
+                           body     BLOB
+                         )'''
+    )
+    _cache_db.execute('CREATE INDEX IF NOT EXISTS http_used ON http (used)')
+  return _cache_db
+
+def library_db():
+  global _library_db
+  if _library_db is None:
+    os.makedirs(data_dir, exist_ok=True)
+    _library_db = sqlite3.connect(library, timeout=60, check_same_thread=False)
+    _library_db.executescript('''
+      CREATE TABLE IF NOT EXISTS files (
+        path   TEXT PRIMARY KEY,
+        album  TEXT,
+        size   INTEGER,
+        mtime  INTEGER,
+        inode  INTEGER,
+        tags   TEXT
+      );
+      CREATE INDEX IF NOT EXISTS files_album ON files (album);
+      CREATE TABLE IF NOT EXISTS albums (
+        dirname TEXT PRIMARY KEY,
+        source  TEXT,
+        url     TEXT,
+        cover   TEXT,
+        tagged  REAL
+      );
+      CREATE TABLE IF NOT EXISTS prints (
+        path   TEXT PRIMARY KEY,
+        album  TEXT,
+        codes  BLOB
+      );
+      CREATE TABLE IF NOT EXISTS print_codes (
+        code   INTEGER,
+        print  INTEGER,
+        pos    INTEGER
+      );
+      CREATE INDEX IF NOT EXISTS print_codes_code ON print_codes (code);'''
+    )
+  return _library_db
+
+def mirror_db():
+  global _mirror_db
+  if _mirror_db is None:
+    os.makedirs(data_dir, exist_ok=True)
+    _mirror_db = sqlite3.connect(mirror, timeout=60, check_same_thread=False)
+    _mirror_db.executescript('''
+      CREATE TABLE IF NOT EXISTS albums (
+        source   TEXT,
+        id       TEXT,
+        imported REAL,
+        data     TEXT,
+        PRIMARY KEY (source, id)
+      );
+      CREATE VIRTUAL TABLE IF NOT EXISTS album_names USING fts5 (
+        names, tokenize='trigram'
+      );'''
+    )
+  return _mirror_db
+
+def file_key(path):
+  st = os.stat(path)
+  return st.st_size, st.st_mtime_ns, st.st_ino
+
+def is_indexed(dirname, items):
+  # unchanged since we tagged it: same files, same sizes, mtimes and inodes
+  dirname = os.path.realpath(dirname)
+  db      = library_db()
+  if not db.execute('SELECT 1 FROM albums WHERE dirname=?', (dirname,)).fetchone():
+    return False
+  known = {row[0]: tuple(row[1:]) for row in db.execute(
+             'SELECT path, size, mtime, inode FROM files WHERE album=?', (dirname,)
+  )}
+  paths = [os.path.realpath(f) for files in items.values() for f in files]
+  try:
+    return len(paths) == len(known) and \
+           all(known.get(p) == file_key(p) for p in paths)
+  except OSError:
+    return False
+
+def index_album(dirname, tagged, album, cover_data):
+  dirname = os.path.realpath(dirname)
+  cover   = hashlib.sha256(cover_data).hexdigest() if cover_data else None
+  db      = library_db()
+  with db:
+    db.execute('DELETE FROM files WHERE album=?', (dirname,))
+    db.execute('INSERT OR REPLACE INTO albums VALUES (?, ?, ?, ?, ?)',
+               (dirname, album.get('source'), album.get('url'), cover, time.time())
+    )
+    db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                   [(path, dirname, *file_key(path), json.dumps(tags))
+                    for path,tags in tagged.items()]
+    )
+
+def process_pool(workers, **kwargs):
+  # workers come from a forkserver: forking this process directly copies
+  # locks other threads happen to hold (cache, http, stats, sqlite) and a
+  # worker that needs one then waits forever
+  return futures.ProcessPoolExecutor(
+    workers, mp_context=multiprocessing.get_context('forkserver'), **kwargs
+  )
+
+def chroma_matrix():
+  # fft bin -> pitch class, for the range notes actually sit in
+  freqs = numpy.fft.rfftfreq(print_frame, 1 / print_rate)
+  keep  = (freqs >= 55) & (freqs <= 5000)
+  pitch = numpy.round(12 * numpy.log2(numpy.where(keep, freqs, 440) / 440))
+  return (pitch.astype(int)[:,None] % 12 == numpy.arange(12)) & keep[:,None]
+
+def decode_audio(filename, rate, channels=1, seconds=None):
+  # (samples, channels) floats, through ffmpeg so every format works
+  out = subprocess.run([ffmpeg, '-v', 'quiet', '-i', filename,
+                        *(['-t', str(seconds)] if seconds else []),
+                        '-ac', str(channels), '-ar', str(rate),
+                        '-f', 'f32le', '-'],
+                       stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                       check=True
+  ).stdout
+  return numpy.frombuffer(out, '<f4').reshape(-1, channels)
+
+def fingerprint(filename):
+  # one 24 bit code per frame: which neighbouring pitch classes are louder,
+  # and which of those differences grew over the last few frames
+  try:
+    samples = decode_audio(filename, print_rate, 1, print_seconds)[:,0]
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  if len(samples) < print_frame * 4:
+    return None
+  frames = numpy.lib.stride_tricks.sliding_window_view(samples, print_frame)
+  frames = frames[::print_hop] * numpy.hanning(print_frame)
+  chroma = numpy.abs(numpy.fft.rfft(frames)) ** 2 @ chroma_matrix()
+  chroma = chroma / (chroma.sum(axis=1, keepdims=True) + 1e-9)
+  chroma = numpy.cumsum(chroma, axis=0)
+  chroma = chroma[print_smooth:] - chroma[:-print_smooth] # moving sum
+  diff   = chroma - numpy.roll(chroma, -1, axis=1)
+  bits   = numpy.concatenate([diff[print_smooth:] > 0,
+                              diff[print_smooth:] > diff[:-print_smooth]],
+                             axis=1
+  )
+  return (bits @ (1 << numpy.arange(24))).astype('<u4').tobytes()
+
+def print_agreement(a, b):
+  # share of equal bits over the overlap of two aligned prints
+  n = min(len(a), len(b))
+  if not n:
+    return 0
+  xor = (a[:n] ^ b[:n]).view(numpy.uint8)
+  return 1 - numpy.unpackbits(xor).sum() / (24 * n)
+
+def k_weighting(size):
+  # squared response of the bs.1770 pre-filter (shelf, then high-pass) at
+  # the rfft bins of a block, so filtering a block is a multiply
+  z = numpy.exp(-1j * 2 * numpy.pi * numpy.fft.rfftfreq(size))
+  h = numpy.ones(len(z))
+  for b, a in k_filter:
+    h = h * numpy.abs(numpy.polyval(b[::-1], z) / numpy.polyval(a[::-1], z)) ** 2
+  return h
+
+def loudness(filename):
+  # mean square of every k-weighted 400ms block (75% overlap), summed over
+  # the channels, and the sample peak
+  try:
+    samples = decode_audio(filename, gain_rate, min(2, channel_count(filename)))
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  size, hop = gain_rate * 4 // 10, gain_rate // 10
+  if len(samples) < size:
+    return None
+  weight = k_weighting(size)
+  blocks = numpy.lib.stride_tricks.sliding_window_view(samples, size, axis=0)
+  blocks = blocks[::hop]
+  power  = numpy.empty(len(blocks))
+  for i in range(0, len(blocks), 256): # (blocks, channels, samples) chunks
+    spec = numpy.abs(numpy.fft.rfft(blocks[i:i+256], axis=-1)) ** 2
+    spec[..., 1:(size+1)//2] *= 2 # the bins rfft folds away
+    power[i:i+256] = (spec * weight).sum(axis=(1, 2)) / size ** 2
+  return power, float(numpy.abs(samples).max())
+
+def gated_loudness(power):
+  # integrated loudness: -70 LUFS absolute gate, then 10 LU under the mean
+  power = power[-0.691 + 10 * numpy.log10(power + 1e-12) > -70]
+  if not len(power):
+    return None
+  gate  = -0.691 + 10 * numpy.log10(power.mean()) - 10
+  power = power[-0.691 + 10 * numpy.log10(power) > gate]
+  return -0.691 + 10 * numpy.log10(power.mean())
+
+def channel_count(filename):
+  try:
+    return mutagen.File(filename).info.channels
+  except Exception:
+    return 2
+
+@timed('replaygain')
+def album_gain(files):
+  # filename -> replaygain tags, with the album gain over every block
+  if not numpy or not ffmpeg or not gain or not files:
+    return {}
+  if gain_workers > 1:
+    with process_pool(min(gain_workers, len(files))) as pool:
+      results = list(pool.map(loudness, files))
+  else:
+    results = list(map(loudness, files))
+  found = [r for r in results if r]
+  if not found:
+    return {}
+  album_loud = gated_loudness(numpy.concatenate([p for p,peak in found]))
+  album_peak = max(peak for p,peak in found)
+  gains = {}
+  for filename, result in zip(files, results):
+    track_loud = result and gated_loudness(result[0])
+    if track_loud is None or album_loud is None:
+      continue
+    gains[filename] = {
+      'replaygain_track_gain' : f'{gain_reference - track_loud:.2f} dB',
+      'replaygain_track_peak' : f'{result[1]:.6f}',
+      'replaygain_album_gain' : f'{gain_reference - album_loud:.2f} dB',
+      'replaygain_album_peak' : f'{album_peak:.6f}'
+    }
+  return gains
+
+@timed('fingerprint')
+def build_prints():
+  # fingerprint the files the library index knows and has no print for yet,
+  # each print is kept with the album name the file was tagged with
+  db    = library_db()
+  paths = [(path, json.loads(tags).get('album_name_orig'))
+           for path, tags in db.execute(
+             '''SELECT path, tags FROM files
+                WHERE path NOT IN (SELECT path FROM prints)'''
+           ) if os.path.exists(path)
+  ]
+  if not paths or not numpy or not ffmpeg:
+    if paths:
+      print('fingerprints need numpy and ffmpeg')
+    return
+  with process_pool(print_workers) as pool:
+    for (path, album), codes in zip(paths,
+                                    pool.map(fingerprint, [p for p,a in paths],
+                                             chunksize=4)):
+      if codes is None:
+        continue
+      with db:
+        cur = db.execute('INSERT INTO prints (path, album, codes) VALUES (?, ?, ?)',
+                         (path, album, codes)
+        )
+        codes = numpy.frombuffer(codes, '<u4')
+        db.executemany('INSERT INTO print_codes VALUES (?, ?, ?)',
+                       [(int(c), cur.lastrowid, pos)
+                        for pos, c in enumerate(codes) if c
+                       ]
+        )
+  print(f'fingerprinted {len(paths)} files')
+
+def match_print(codes):
+  # vote on (track, offset) for every code both share, then check the best
+  # alignments bit by bit
+  codes = numpy.frombuffer(codes, '<u4')
+  where = collections.defaultdict(list)
+  for pos, code in enumerate(codes.tolist()):
+    if code:
+      where[code].append(pos)
+  votes = collections.Counter()
+  db    = library_db()
+  keys  = list(where)
+  for i in range(0, len(keys), 500):
+    chunk = keys[i:i+500]
+    for code, track, pos in db.execute(
+          'SELECT code, print, pos FROM print_codes WHERE code IN ({})'.format(
+            ','.join('?' * len(chunk))), chunk):
+      for mine in where[code]:
+        votes[(track, pos - mine)] += 1
+  for (track, offset), count in votes.most_common(3):
+    album, theirs = db.execute(
+      'SELECT album, codes FROM prints WHERE rowid=?', (track,)
+    ).fetchone()
+    theirs = numpy.frombuffer(theirs, '<u4')
+    mine   = codes[max(0, -offset):]
+    theirs = theirs[max(0, offset):]
+    if print_agreement(mine, theirs) >= print_match:
+      return album
+  return None
+
+@timed('fingerprint match')
+def identify_album(items):
+  # the album most of the files were matched to, by its tagged name, and
+  # what to tell about it; printed by the caller, this may run on the
+  # prefetch thread while the last album is still being edited
+  files = [f for key, files in sorted(items.items()) for f in files]
+  if not files or not numpy or not ffmpeg or \
+     not library_db().execute('SELECT 1 FROM prints LIMIT 1').fetchone():
+    return None, []
+  with process_pool(min(print_workers, len(files))) as pool:
+    prints = list(pool.map(fingerprint, files))
+  votes = collections.Counter(match_print(p) for p in prints if p)
+  votes.pop(None, None)
+  if not votes:
+    return None, []
+  album, count = votes.most_common(1)[0]
+  if count * 2 < len(files):
+    return None, []
+  return album, [f'fingerprints match "{album}" ({count}/{len(files)} files)']
+
+def cache_get(key):
+  with _cache_lock:
+    row = cache_db().execute(
+      'SELECT body, etag, modified, fetched FROM http WHERE key=?', (key,)
+    ).fetchone()
+    if row:
+      # written with the next put instead of a commit for every hit
+      _cache_used[key] = time.time()
+      if len(_cache_used) >= 256:
+        flush_used()
+        cache_db().commit()
+    return row
+
+def flush_used():
+  cache_db().executemany('UPDATE http SET used=? WHERE key=?',
+                         [(used, key) for key, used in _cache_used.items()]
+  )
+  _cache_used.clear()
+
+def cache_put(key, body, etag=None, modified=None):
+  global _cache_total
+  now = time.time()
+  with _cache_lock:
+    db = cache_db()
+    if _cache_total is None:
+      _cache_total = db.execute('SELECT TOTAL(size) FROM http').fetchone()[0]
+    old = db.execute('SELECT size FROM http WHERE key=?', (key,)).fetchone()
+    db.execute('INSERT OR REPLACE INTO http VALUES (?, ?, ?, ?, ?, ?, ?)',
+               (key, etag, modified, now, now, len(body), body)
+    )
+    _cache_used.pop(key, None)
+    flush_used()
+    _cache_total += len(body) - (old[0] if old else 0)
+    if _cache_total > cache_size:
+      # least recently used entries go first, down to 90% of the size so the
+      # next put does not have to do it again. other processes write here
+      # too, so this starts from the real total
+      _cache_total = db.execute('SELECT TOTAL(size) FROM http').fetchone()[0]
+      drop = []
+      for old_key, size in db.execute('SELECT key, size FROM http ORDER BY used'):
+        if _cache_total <= cache_size * 0.9:
+          break
+        drop.append((old_key,))
+        _cache_total -= size
+      db.executemany('DELETE FROM http WHERE key=?', drop)
+      prune_images(db)
+    db.commit()
+
+def prune_images(db):
+  # stored images no cached url points at any more
+  keep = {body.decode() for body, in db.execute(
+    "SELECT body FROM http WHERE key LIKE 'image:%'"
+  )}
+  for path in glob.glob(os.path.join(image_dir, '*', '*')):
+    if os.path.basename(path) not in keep and not path.endswith('.tmp'):
+      with contextlib.suppress(OSError):
+        os.remove(path)
+
+def cache_lookup(key, ttl=None, stat='cache'):
+  # counted once, as a hit or miss of what it is for (`stat`, None when the
+  # caller counts it itself)
+  row = cache_get(key)
+  ttl = cache_ttl if ttl is None else ttl
+  hit = row and (offline or time.time() - row[3] < ttl)
+  if stat:
+    count(f'{stat} hit' if hit else f'{stat} miss')
+  return row[0] if hit else None
+
+def fetch(url, params=None, key=None, ttl=None):
+  if params:
+    url = requests.Request('GET', url, params=params).prepare().url
+  key = key or url
+  ttl = cache_ttl if ttl is None else ttl
+  row = cache_get(key)
+  if row and (offline or time.time() - row[3] < ttl):
+    count('cache hit')
+    return row[0]
+  if offline:
+    count('cache miss')
+    return None
+
+  headers = {}
+  if row and row[1]:
+    headers['If-None-Match'] = row[1]
+  if row and row[2]:
+    headers['If-Modified-Since'] = row[2]
+  try:
+    r = http_get(url, headers=headers)
+  except requests.RequestException:
+    if row: # stale is better than nothing
+      count('cache stale')
+      return row[0]
+    raise
+  if r.status_code == 304 and row:
+    count('cache revalidated')
+    cache_put(key, row[0], row[1], row[2])
+    return row[0]
+  count('cache miss')
+  if r.status_code != 200:
+    return row[0] if row else None
+  cache_put(key, r.content, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+  return r.content
+
+def source_name(domain):
+  return 'utaitedb' if 'tai' in domain.lower() else 'vocadb'
+
+def get_char_name(search):
+  search = clean_char(search)
+
+  global charnames
+  if charnames.get(search):
+    return charnames.get(search)
+  name = cache_lookup(f'mal:charname:{search}', stat='character')
+  if name:
+    charnames[search] = name.decode()
+    return charnames[search]
+
+  r = fetch(f'{mal_url}character.php?q={search}')
+  if not r:
+    return search
+  r = re.findall('<tr>.*?href="([^"]*?)".*?</tr>', str(r))
+  if not r: # not on mal, remember that too
+    charnames[search] = search
+    cache_put(f'mal:charname:{search}', search.encode())
+    return search
+  url = r[0]
+  if 'http' not in url:
+    url = mal_url+url
+
+  r = fetch(url)
+  if not r:
+    return search
+
+  r = re.search('<div[^<]*?rmal_hea[^<]*?<span[^<]*?<small>\(?([^<]*?)\)?</',
+    r.decode(errors='replace')
+  )
+
+  name = r.group(1) if r else search
+  charnames[search] = name
+  cache_put(f'mal:charname:{search}', name.encode())
+  return name
+
+@timed('characters')
+def get_char_names(names):
+  # all of an album's characters at once: cached ones come straight back and
+  # the mal requests go out as fast as http_rates allows, not one at a time
+  names = set(names)
+  if not names:
+    return {}
+  with futures.ThreadPoolExecutor(min(fetch_workers, len(names))) as pool:
+    return dict(zip(names, pool.map(get_char_name, names)))
+
+def replace_all(text, reps):
+  # one pass over text, where several keys match the longest one wins
+  reps = {k: v for k, v in reps.items() if k}
+  if not reps:
+    return text
+  pattern = '|'.join(map(re.escape, sorted(reps, key=len, reverse=True)))
+  return re.sub(pattern, lambda m: reps[m.group(0)], text)
+
+def search_vocadb(terms, domain=None):
+  domain = domain or vocadb_url
+  search = fetch(f'{domain}/api/albums',
+                 params={'query':terms, 'preferAccurateMatches':'true'},
+                 ttl=search_ttl
+  )
+  for item in json.loads(search or '{}').get('items', []):
+    item['vocadb'] = True
+    item['domain'] = domain
+    yield item
+
+def needs_lookup(artist):
+  # album artists only carry a name and category; vocalists need their record
+  cat = artist.get('categories', '')
+  return (not artist.get('defaultName') or not cat) and cat in ('', 'Vocalist')
+
+@timed('artists')
+def get_artists_vocadb(ids, domain=None):
+  domain  = domain or vocadb_url
+  source  = source_name(domain)
+  missing = [i for i in dict.fromkeys(ids) if (source, i) not in vocadb_artists]
+
+  def get(artist_id):
+    try:
+      return json.loads(fetch(f'{domain}/api/artists/{artist_id}',
+                              key=f'{source}:artist:{artist_id}'
+      ))
+    except Exception:
+      return None
+
+  if missing:
+    with futures.ThreadPoolExecutor(fetch_workers) as pool:
+      for artist_id, artist in zip(missing, pool.map(get, missing)):
+        vocadb_artists[(source, artist_id)] = artist
+  return {i: vocadb_artists.get((source, i)) for i in ids}
+
+def get_info(item):
+  if type(item) == dict and item.get('vocadb', False):
+    return get_info_vocadb(item.get('id'), item.get('domain'))
+  elif type(item) == dict and item.get('mirror', False):
+    return get_info_mirror(item['source'], item['id'])
+  elif type(item) == vgmdb().VGMdbProductSummary:
+    return get_info_vgmdb(item.id)
+  return None
+
+@timed('get_info_vocadb')
+def get_info_vocadb(album_id, domain=None):
+  domain = (domain or vocadb_url).lower()
+  params = {'fields'    :'Tracks,mainPicture,Tags,Description,Artists',
+            'songFields':'Artists',
+            'lang'      :'Romaji'
+  }
+  source = source_name(domain)
+  album  = fetch(f'{domain}/api/albums/{album_id}', params=params,
+                 key=f'{source}:album:{album_id}'
+  )
+  return vocadb_info(json.loads(album), domain)
+
+def vocadb_info(album, domain):
+  album_id = album['id']
+  info     = {}
+  tmp      = None
+  date     = {'year':1970,'month':1,'day':0}
+  date.update(album.get('releaseDate', {}))
+
+  info['album_name_orig']  = ''
+  info['album_name_latin'] = ''
+  info['source']           = 'vocadb'
+  info['url']              = f'{domain}/Al/{album_id}'
+  info['cover']            = f'{domain}/Album/CoverPicture/{album_id}?v=3'
+  info['thumb']            = (album.get('mainPicture') or {}).get('urlThumb', '')
+  info['notes']            = album.get('description', '')
+  info['date']             = '{year:04}-{month:02}-{day:02}'.format(**date)
+  info['genres']           = ['Utaite'] if 'tai' in domain else ['Vocaloid']
+  info['discs']            = []
+  info['artists']          = []
+
+  info['album_name_orig']  = clean_orig(album.get('defaultName', '').strip())
+  info['album_name_orig']  = info['album_name_orig'].strip()
+  info['album_name_latin'] = clean_latin(album.get('name', '').strip()).strip()
+
+  for tag in album.get('tags', []):
+    tag = clean_genre(tag['tag']['name'].lower())
+    if tag and tag not in info['genres']:
+      info['genres'].append(tag)
+
+  ids = [a.get('artist', a).get('id') for a in album.get('artists', [])
+         if needs_lookup(a)
+  ]
+  for track in album.get('tracks', []):
+    for artist in track.get('song', {}).get('artists', []):
+      artist = artist.get('artist', artist)
+      if not artist.get('additionalNames', artist.get('name')):
+        ids.append(artist.get('id'))
+  resolved = get_artists_vocadb([i for i in ids if i is not None], domain)
+
+  for artist in album.get('artists', []):
+    cat = artist.get('categories', '')
+    try:
+      if needs_lookup(artist):
+        artist = resolved[artist.get('artist', artist)['id']]
+      if artist.get('categories', cat) == 'Vocalist':
+        tmp = artist.get('defaultName').strip()
+        tmp = artist_alias(tmp)
+        if tmp not in info['artists']:
+          info['artists'].append(tmp)
+    except:
+      pass
+
+  tracks    = album.get('tracks', [])
+  disc_nums = sorted(set([t.get('discNumber',1) for t in tracks]))
+  discs     = [
+              sorted([t for t in tracks if t.get('discNumber',1) == num],
+                     key = lambda x: x.get('trackNumber',1)
+              ) for num in disc_nums
+  ]
+  for disc,num in zip(discs,disc_nums):
+    d       = []
+    names   = clean_names([t.get('song', {}).get('defaultName', '') for t in disc])
+    names_l = clean_names([t.get('song', {}).get('name', '') for t in disc], True)
+    for track,name,name_l in zip(disc, names, names_l):
+      url = ''
+      #asaik vocadb does not have album covers
+      #for cover in album.covers:
+      #  name = cover.get('name', '')
+      #  if is_disc(name) and (num==1 or str(num) in name):
+      #    url = cover.get('full', '')
+      #    break
+      artists = []
+      for artist in track.get('song', {}).get('artists', []):
+         if artist.get('categories', '') == 'Vocalist':
+           artist = artist.get('artist', artist)
+           tmp = artist.get('additionalNames', artist.get('name', ''))
+           if not tmp and resolved.get(artist.get('id')):
+             tmp = resolved[artist['id']].get('defaultName', '')
+           tmp = artist_alias(tmp)
+           if tmp not in artists:
+             artists.append(tmp)
+      d.append({'name':name, 'name_lat':name_l, 'artists':artists,
+                'length':track.get('song', {}).get('lengthSeconds') or None
+      })
+    info['discs'].append({'cover':url, 'tracks':d})
+
+  return info
+
+@functools.lru_cache(maxsize=None)
+def vgmdb():
+  # imported on first use, it is slow to load and most runs never need it
+  import pyvgmdb
+  pyvgmdb.logging.getLogger().setLevel(pyvgmdb.logging.ERROR)
+  return pyvgmdb
+
+def search_vgmdb(terms):
+  if offline:
+    return []
+  return to_gen(vgmdb().search_albums, terms)
+
+def get_album_vgmdb(album_id):
+  pyvgmdb = vgmdb() # also needed to unpickle cached albums
+  key     = f'vgmdb:album:{album_id}'
+  album   = cache_lookup(key)
+  if album:
+    return pickle.loads(album)
+  if offline:
+    return None
+  album = pyvgmdb.get_album(album_id)
+  try:
+    cache_put(key, pickle.dumps(album))
+  except (pickle.PicklingError, TypeError, AttributeError):
+    pass
+  return album
+
+def track_length(text):
+  # vgmdb lengths are "m:ss" (or "h:mm:ss"), unknown ones "Unknown"
+  try:
+    return functools.reduce(lambda a,b: a*60 + int(b), text.split(':'), 0) or None
+  except ValueError:
+    return None
+
+@timed('get_info_vgmdb')
+def get_info_vgmdb(album_id):
+  album = get_album_vgmdb(album_id)
+  if not album:
+    return None
+  return vgmdb_info(album)
+
+def vgmdb_info(album):
+  info  = {}
+  tmp   = None
+
+  info['album_name_orig']  = ''
+  info['album_name_latin'] = ''
+  info['source']           = 'vgmdb'
+  info['url']              = 'http://vgmdb.net/{}'.format(album.link)
+  info['cover']            = album.picture_full  or album.picture_small
+  info['thumb']            = album.picture_small or album.picture_thumb
+  info['notes']            = album.notes
+  info['date']             = album.release_date
+  info['genres']           = []
+  info['discs']            = []
+  info['artists']          = []
+
+  for key in ('ja', 'ja-latn', 'en'):
+    tmp = album.names.get(key, '').rpartition(' / ')[0]
+    if tmp:
+      break
+  else:
+    tmp   = album.name
+  info['album_name_orig'] = clean_orig(tmp).strip()
+
+  for key in ('ja-latn', 'en'):
+    tmp = album.names.get(key, '').rpartition(' / ')[0]
+    if tmp:
+      break
+  else:
+    tmp   = album.name
+  info['album_name_latin'] = clean_latin(tmp).strip()
+
+  # "Character (CV: Actor)" in the notes, by the full text, with
+  # "A & B (CV: C & D)" split into its pairs
+  pairs = {
+    m[0]: list(zip(re.split('\\s*&\\s*', m[1]), re.split('\\s*&\\s*', m[2])))
+    for m in re.findall(r'(?:is|by|formed|[:,;]|and)\s+(([\w& ]+?) +\(CV[:.]?\s*([& \w]+)\))',
+                        info['notes']
+    )
+  }
+  characters = {a: c for found in pairs.values() for c, a in found}
+
+  performers = [] # (english name, the one used in the tags)
+  for artist in album.performers:
+    for key in ('ja', 'en'):
+      tmp = artist.names.get(key, '')
+      if tmp:
+        break
+    else:
+      tmp = list(artist.names.values() or ['Unknown'])[0]
+    performers.append((artist.names.get('en', ''), tmp))
+  local = {en_name: tmp for en_name, tmp in performers if en_name}
+
+  names = get_char_names(characters[a] for a in local if a in characters)
+  for en_name, tmp in performers:
+    if en_name in characters: # voice actors are credited with their role
+      char = characters[en_name]
+      tmp  = f'{names.get(char, char)} (CV: {tmp})'
+    tmp = artist_alias(tmp)
+    if tmp not in info['artists']:
+      info['artists'].append(tmp)
+
+  reps  = {a: name for a, name in local.items() if a not in characters}
+  for full, found in pairs.items():
+    if len(found) > 1 or any(a in local for c, a in found):
+      reps[full] = '; '.join(f'{names.get(c, c)} (CV: {local.get(a, a)})'
+                             for c, a in found
+      )
+  info['notes'] = replace_all(info['notes'], reps)
+
+  for genre in album.categories:
+    genre = clean_genre(genre)
+    if tmp not in info['genres']:
+      info['genres'].append(genre)
+
+  discs_info = {int(i[1]): i[2]
+                for i in re.finditer('DISC (\d+)(.*?)(?=DISC|\n\n\n|$)',
+                                     info['notes'], re.S
+                )
+  }
+
+  for num,disc in enumerate(album.discs, 1):
+    d     = []
+    url   = ''
+    dinfo = discs_info.get(num, info['notes'])
+    tracks_info = {int(i[1]): i[2]
+                 for i in re.finditer('M-(\d\d)(.*?)(?=M-|\n\n|$)',dinfo,re.S)
+    }
+
+    for cover in album.covers:
+      name = cover.get('name', '')
+      if is_disc(name) and (num==1 or str(num) in name):
+        url = cover.get('full', '')
+        break
+    for track_num,track in enumerate(disc.get('tracks', [])):
+      track_info = tracks_info.get(track_num, '')
+      for key in ('Japanese', 'Romaji', 'English'):
+        tmp = track.get('names', {}).get(key, '')
+        if tmp:
+          break
+      else:
+        tmp = list(track.get('names', {1:'Unknown'}).values())[0]
+      name = clean_orig(tmp)
+
+      for key in ('Romaji', 'English'):
+        tmp = track.get('names', {}).get(key, '')
+        if tmp:
+          break
+      else:
+        tmp   = ''
+      name_l  = clean_latin(tmp)
+
+      a = []
+      for artist in info['artists']:
+        if artist in track_info and artist not in a:
+          a.append(artist)
+
+      d.append({'name':name, 'name_lat':name_l, 'artists':a,
+                'length':track_length(track.get('track_length', ''))
+      })
+    info['discs'].append({'cover':url, 'tracks':d})
+
+  return info
+
+def vgmdb_album(data):
+  # vgmdb.info json -> the attributes pyvgmdb gives get_info_vgmdb
+  album = types.SimpleNamespace(
+    link          = data.get('link', ''),
+    name          = data.get('name', ''),
+    names         = data.get('names', {}),
+    notes         = data.get('notes', ''),
+    release_date  = data.get('release_date', ''),
+    picture_full  = data.get('picture_full', ''),
+    picture_small = data.get('picture_small', ''),
+    picture_thumb = data.get('picture_thumb', ''),
+    categories    = data.get('categories', []),
+    discs         = data.get('discs', []),
+    covers        = data.get('covers', [])
+  )
+  album.performers = [types.SimpleNamespace(names=p.get('names', {}))
+                      for p in data.get('performers', [])
+  ]
+  return album
+
+def mirror_entry(data, source=None):
+  # (source, id, searchable names) of a dumped album, None if it is not one
+  if str(data.get('link', '')).startswith('album/'):
+    names = [data.get('name', '')] + list(data.get('names', {}).values())
+    return 'vgmdb', data['link'].split('/')[1], names
+  if 'defaultName' in data and 'id' in data:
+    # vocadb and utaitedb dumps look the same, unless told (--source) the
+    # thumbnails give it away
+    thumb = (data.get('mainPicture') or {}).get('urlThumb', '')
+    names = [data['defaultName'], data.get('name', ''),
+             data.get('additionalNames', '')
+    ] + [n.get('value', '') for n in data.get('names', [])]
+    return source or source_name(thumb), str(data['id']), names
+  return None
+
+def read_dump(filename):
+  # a single album, a list of them, or one album per line
+  with open(filename, encoding='utf-8') as f:
+    text = f.read()
+  try:
+    data = json.loads(text)
+  except ValueError:
+    data = [json.loads(line) for line in text.splitlines() if line.strip()]
+  return data if type(data) == list else [data]
+
+def import_mirror(filenames, source=None):
+  db    = mirror_db()
+  count = 0
+  with _mirror_lock, db:
+    for filename in filenames:
+      for data in read_dump(filename):
+        entry = mirror_entry(data, source)
+        if not entry:
+          print(f'{filename}: skipping an entry that is not an album')
+          continue
+        kind, album_id, names = entry
+        db.execute('''INSERT INTO albums VALUES (?, ?, ?, ?)
+                      ON CONFLICT (source, id) DO UPDATE
+                      SET imported=excluded.imported, data=excluded.data''',
+                   (kind, album_id, time.time(), json.dumps(data))
+        )
+        rowid = db.execute('SELECT rowid FROM albums WHERE source=? AND id=?',
+                           (kind, album_id)
+        ).fetchone()[0]
+        # latin spellings of the names too, so romaji finds kana titles
+        names = [n for n in names if n]
+        latin = [unidecode.unidecode(n) for n in names]
+        names = '\n'.join(dict.fromkeys(names + latin))
+        db.execute('DELETE FROM album_names WHERE rowid=?', (rowid,))
+        db.execute('INSERT INTO album_names (rowid, names) VALUES (?, ?)',
+                   (rowid, names)
+        )
+        count += 1
+  print(f'imported {count} albums into {mirror}')
+
+def search_mirror(terms, source=None, limit=None):
+  if not os.path.exists(mirror):
+    return []
+  limit = limit or max_candidates
+  where = ' AND a.source = ?' if source else ''
+  extra = [source] if source else []
+  rows  = []
+  with _mirror_lock:
+    db = mirror_db()
+    if re.match('^\\d+$', terms.strip()):
+      rows += db.execute('SELECT a.source, a.id FROM albums a WHERE a.id = ?'
+                         + where, [terms.strip()] + extra
+      ).fetchall()
+    # trigram fts can not match anything shorter than three characters
+    words = [w for w in terms.split() if len(w) >= 3]
+    if words:
+      match = ' '.join('"{}"'.format(w.replace('"', '""')) for w in words)
+      rows += db.execute('SELECT a.source, a.id FROM album_names n '
+                         'JOIN albums a ON a.rowid = n.rowid '
+                         'WHERE n.names MATCH ?' + where +
+                         ' ORDER BY n.rank LIMIT ?', [match] + extra + [limit]
+      ).fetchall()
+  return [{'mirror':True, 'source':s, 'id':i}
+          for s,i in list(dict.fromkeys(rows))[:limit]
+  ]
+
+def mirror_album(source, album_id):
+  if not os.path.exists(mirror):
+    return None
+  with _mirror_lock:
+    row = mirror_db().execute('SELECT data FROM albums WHERE source=? AND id=?',
+                              (source, str(album_id))
+    ).fetchone()
+  return json.loads(row[0]) if row else None
+
+@timed('get_info_mirror')
+def get_info_mirror(source, album_id):
+  album = mirror_album(source, album_id)
+  if not album:
+    return None
+  if source == 'vgmdb':
+    return vgmdb_info(vgmdb_album(album))
+  return vocadb_info(album, utaitedb_url if source == 'utaitedb' else vocadb_url)
+
+def serve_mirror(port, host='127.0.0.1'):
+  import http.server
+
+  class MirrorHandler(http.server.BaseHTTPRequestHandler):
+    # answers the bits of the vocadb api we use, /utaitedb/api/... for utaitedb
+    def do_GET(self):
+      url    = urllib.parse.urlsplit(self.path)
+      params = urllib.parse.parse_qs(url.query)
+      path   = url.path.strip('/').split('/')
+      source = 'vocadb'
+      if path[0] == 'utaitedb':
+        source, path = 'utaitedb', path[1:]
+      if path[:2] != ['api', 'albums'] or len(path) > 3:
+        return self.reply(404, {'message':'not found'})
+      if len(path) == 3:
+        album = mirror_album(source, path[2])
+        return self.reply(200, album) if album else \
+               self.reply(404, {'message':'no such album'})
+      terms = params.get('query', [''])[0]
+      items = []
+      for hit in search_mirror(terms, source, int(params.get('maxResults', [10])[0])):
+        album = mirror_album(hit['source'], hit['id'])
+        items.append({k:album.get(k) for k in ('id', 'defaultName', 'name',
+                                               'additionalNames', 'releaseDate')
+        })
+      self.reply(200, {'items':items, 'totalCount':len(items)})
+
+    def reply(self, status, data):
+      body = json.dumps(data).encode()
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json; charset=utf-8')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+
+  server = http.server.ThreadingHTTPServer((host, port), MirrorHandler)
+  print(f'serving {mirror} on http://{host}:{server.server_port}/ '
+        f'(utaitedb under /utaitedb/)'
+  )
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+def image_path(digest):
+  return os.path.join(image_dir, digest[:2], digest)
+
+def store_image(data):
+  # content addressed, so every album/disc using the same art shares a file
+  digest = hashlib.sha256(data).hexdigest()
+  path   = image_path(digest)
+  if not os.path.exists(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(data)
+    os.replace(tmp, path)
+  return digest
+
+@timed('image fetch')
+def fetch_image(url):
+  if not url:
+    return None
+  data = images.get(url)
+  if data is not None:
+    count('image hit')
+    return data
+
+  digest = cache_lookup(f'image:{url}', stat=None)
+  path   = digest and image_path(digest.decode())
+  if path and os.path.exists(path):
+    count('image hit')
+    with open(path, 'rb') as f:
+      data = f.read()
+  else:
+    count('image miss')
+    r = None if offline else http_get(url)
+    if r is not None and r.status_code == 200:
+      data = r.content
+      cache_put(f'image:{url}', store_image(data).encode())
+  if data is not None:
+    images.put(url, data)
+  return data
+
+def image_type(data):
+  for magic, mimetype, ext in image_types:
+    if data.startswith(magic):
+      return mimetype, ext
+  if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+    return 'image/webp', '.webp'
+  return 'image/jpeg', '.jpg'
+
+@timed('cover resize')
+def normalize_cover(data):
+  # what gets embedded in every track: small, progressive jpeg
+  if not data or not Image:
+    return data
+  try:
+    image = Image.open(io.BytesIO(data))
+    if image_type(data)[0] == 'image/jpeg' and max(image.size) <= cover_size:
+      return data
+    image = image.convert('RGB')
+    image.thumbnail((cover_size, cover_size), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=cover_quality, optimize=True,
+               progressive=cover_progressive
+    )
+  except (OSError, ValueError):
+    return data
+  return min(out.getvalue(), data, key=len)
+
+def pict_test(audio, data=None):
+  try:
+    x = audio.pictures
+    if x:
+      return True
+  except Exception:
+    pass
+  # only skip if the art would not change
+  if type(audio) == mutagen.easyid3.EasyID3:
+    return any(p.data == data for p in audio._EasyID3__id3.getall('APIC'))
+  if type(audio) == mutagen.easymp4.EasyMP4:
+    return bool(audio.tags and 'covr' in audio.tags._EasyMP4Tags__mp4)
+  if 'covr' in audio or 'APIC:' in audio or 'metadata_block_picture' in audio:
+    return True
+  return False
+
+def make_picture(kind, imagedata, mimetype):
+  # built once per image and shared by every track it goes into
+  key   = (kind, hashlib.sha256(imagedata).digest(), mimetype)
+  image = pictures.get(key)
+  if image is None:
+    if kind == mutagen.easyid3.EasyID3:
+      image = mutagen.id3.APIC(3, mimetype, 3, 'Front cover', imagedata)
+    else:
+      image = mutagen.flac.Picture()
+      image.type = 3
+      image.desc = 'front cover'
+      image.mime = mimetype
+      image.data = imagedata
+    pictures.put(key, image)
+  return image
+
+@timed('add_pic')
+def add_pic(obj, path):
+  if type(path) == str:
+    with open(path, 'rb') as f:
+      imagedata = f.read()
+  else:
+    imagedata = path
+  mimetype = image_type(imagedata)[0]
+  if pict_test(obj, imagedata): #art is already there
+    return
+
+  # nothing is written here, save_song() commits it with the other tags
+  if type(obj) == mutagen.easyid3.EasyID3:
+    id3 = obj._EasyID3__id3
+    id3.add(make_picture(mutagen.easyid3.EasyID3, imagedata, mimetype))
+  elif type(obj) == mutagen.flac.FLAC:
+    obj.add_picture(make_picture(mutagen.flac.FLAC, imagedata, mimetype))
+  elif type(obj) in (mutagen.oggvorbis.OggVorbis, mutagen.oggopus.OggOpus):
+    image = make_picture(mutagen.flac.FLAC, imagedata, mimetype)
+    obj['metadata_block_picture'] = [base64.b64encode(image.write()).decode()]
+  elif type(obj) == mutagen.easymp4.EasyMP4:
+    if obj.tags is None:
+      obj.add_tags()
+    cover = mutagen.mp4.MP4Cover
+    fmt   = cover.FORMAT_PNG if mimetype == 'image/png' else cover.FORMAT_JPEG
+    obj.tags._EasyMP4Tags__mp4['covr'] = [cover(imagedata, fmt)]
+
+def is_disc(dirname):
+  if type(dirname) == list:
+    for name in dirname:
+      if is_disc(name):
+        return True
+    else:
+      return False
+  if '.' in dirname:
+    return False
+  name = os.path.basename(dirname).lower()
+  return name.startswith('cd') or 'disk' in name or 'disc' in name
+
+id3_fields = { # frame -> EasyID3 style key, for peek_tags()
+  'TIT2' : 'title',
+  'TALB' : 'album',
+  'TPE1' : 'artist',
+  'TPE2' : 'albumartist',
+  'TCON' : 'genre',
+  'TDRC' : 'date',
+  'TYER' : 'date',
+  'TDAT' : 'date',
+  'TIME' : 'date',
+  'TRCK' : 'tracknumber',
+  'TPOS' : 'discnumber'
+}
+id3_dates     = ('TYER', 'TDAT', 'TIME') # v2.3's pieces of TDRC
+id3_encodings = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+def id3_date(frames):
+  # year, DDMM and HHMM joined into a timestamp the way mutagen does when it
+  # upgrades a v2.3 tag, so the date reads the same either way
+  dates = []
+  pieces = zip_longest(*(frames.get(name, []) for name in id3_dates),
+                       fillvalue=''
+  )
+  for year, day, clock in pieces:
+    if not re.fullmatch('[0-9]+', year):
+      continue
+    date = year
+    if re.fullmatch('[0-9]{4}', day):
+      date += f'-{day[2:]}-{day[:2]}'
+      if re.fullmatch('[0-9]{4}', clock):
+        date += f' {clock[:2]}:{clock[2:]}:00'
+    dates.append(date)
+  return dates
+
+def peek_flac(f, fields):
+  # walk the metadata blocks, only the vorbis comment is read and decoded;
+  # pictures are skipped and only their (offset, size) is kept
+  tags = {'~pictures':[]}
+  if f.read(4) != b'fLaC':
+    return None
+  last = False
+  while not last:
+    header = f.read(4)
+    if len(header) < 4:
+      break
+    last  = header[0] & 0x80
+    kind  = header[0] & 0x7f
+    size  = int.from_bytes(header[1:], 'big')
+    start = f.tell()
+    if kind == 0: # streaminfo
+      info = f.read(18)
+      rate = int.from_bytes(info[10:13], 'big') >> 4
+      num  = int.from_bytes(info[13:18], 'big') & 0xfffffffff
+      tags['~length'] = [num / rate if rate else 0]
+    elif kind == 4: # vorbis comment
+      data  = f.read(size)
+      pos   = 4 + struct.unpack_from('<I', data)[0]
+      count = struct.unpack_from('<I', data, pos)[0]
+      pos  += 4
+      for i in range(count):
+        length = struct.unpack_from('<I', data, pos)[0]
+        key, sep, value = data[pos+4:pos+4+length].partition(b'=')
+        key  = key.decode('ascii', 'replace').lower()
+        pos += 4 + length
+        if fields is None or key in fields:
+          tags.setdefault(key, []).append(value.decode('utf-8', 'replace'))
+    elif kind == 6:
+      tags['~pictures'].append((start, size))
+    f.seek(start + size)
+  return tags
+
+def peek_id3(f, fields):
+  header = f.read(10)
+  if len(header) < 10 or header[:3] != b'ID3' or header[3] not in (3, 4) \
+     or header[5] & 0xc0: # unsynchronised or extended header
+    return None
+  version = header[3]
+  size    = sum(b << (7 * (3-i)) for i, b in enumerate(header[6:10]))
+  end     = 10 + size
+  tags    = {'~pictures':[]}
+  dates   = {}
+  while f.tell() + 10 <= end:
+    frame = f.read(10)
+    name  = frame[:4].decode('latin-1')
+    if not name.strip('\0'):
+      break # padding
+    if version == 4:
+      length = sum(b << (7 * (3-i)) for i, b in enumerate(frame[4:8]))
+    else:
+      length = int.from_bytes(frame[4:8], 'big')
+    start = f.tell()
+    key   = id3_fields.get(name)
+    if name == 'APIC':
+      tags['~pictures'].append((start, length))
+    elif key and (fields is None or key in fields):
+      if frame[9] & (0x0f if version == 4 else 0xc0): # compressed, etc
+        return None
+      data  = f.read(length)
+      enc   = id3_encodings[data[0]] if data and data[0] < 4 else 'latin-1'
+      text  = data[1:].decode(enc, 'replace')
+      value = [v.lstrip('\ufeff') for v in text.split('\0') if v]
+      if name in id3_dates:
+        dates[name] = value
+      else:
+        tags.setdefault(key, []).extend(value)
+    f.seek(start + length)
+  if 'date' not in tags and (date := id3_date(dates)):
+    tags['date'] = date
+  try: # the first audio frame (and its xing/vbri header) gives the length
+    tags['~length'] = [mutagen.mp3.MPEGInfo(f, end).length]
+  except (mutagen.MutagenError, OSError):
+    pass
+  return tags
+
+def peek_tags(filename, fields=None):
+  # tags without loading the whole file or its embedded art; falls back to
+  # mutagen for anything the header readers do not handle
+  fields = set(fields) if fields else None
+  ext    = music_ext(filename)
+  if ext in ('flac', 'mp3'):
+    with open(filename, 'rb') as f:
+      tags = peek_flac(f, fields) if ext == 'flac' else peek_id3(f, fields)
+    if tags is not None:
+      return tags
+  return open_tags(filename)
+
+def music_ext(filename):
+  ext = filename.rpartition('.')[2].lower()
+  return ext if ext in formats else None
+
+def open_tags(filename):
+  easy_keys()
+  return formats.get(music_ext(filename), formats['mp3'])(filename)
+
+def save_image(url, dirname):
+  if not url:
+    return ''
+
+  if is_disc(dirname):
+    filename = 'disc'
+  else:
+    filename = 'folder'
+  filename = os.path.join(dirname, filename)
+  if glob.glob(glob.escape(filename)+'.*'):
+    return
+
+  data = fetch_image(url)
+  if not data:
+    return ''
+  filename += image_type(data)[1]
+  if plan is not None:
+    plan_op('image', path=filename, image=plan_image(data))
+    return filename
+  write_image(data, filename)
+  return filename
+
+def write_image(data, filename):
+  # a copy, editing it must not change the stored one. removing it first
+  # breaks the hard links to the store older versions made
+  with contextlib.suppress(FileNotFoundError):
+    os.remove(filename)
+  with open(filename, 'wb') as f:
+    f.write(data)
+
+def fan_out(pool, search, get):
+  # the source's hits are known as soon as its search returns, so queue the
+  # detail fetches from the worker instead of waiting on the caller
+  def run():
+    return [pool.submit(get, hit) for hit in search()]
+  return pool.submit(run)
+
+def search_candidates(search):
+  sources = []
+  if re.match('^\\d+$', search):
+    sources += [
+      (lambda: [int(search)], get_info_vgmdb),
+      (lambda: [search],      get_info_vocadb),
+      (lambda: [search],      lambda i: get_info_vocadb(i, utaitedb_url))
+    ]
+  sources += [
+    (lambda: search_mirror(search), get_info),
+    (lambda: list(islice(search_vgmdb(search), max_candidates)),
+     get_info),
+    (lambda: list(islice(search_vocadb(search), max_candidates)), get_info),
+    (lambda: list(islice(search_vocadb(search, utaitedb_url),
+                         max_candidates)),
+     get_info)
+  ]
+
+  pool  = futures.ThreadPoolExecutor(fetch_workers)
+  start = time.monotonic()
+  count = 0
+  seen  = set()
+  try:
+    # all sources run at once, but results are yielded in source order
+    for source in [fan_out(pool, *s) for s in sources]:
+      deadline = start + source_timeout
+      try:
+        details = source.result(timeout=max(0, deadline - time.monotonic()))
+      except Exception:
+        continue
+      for detail in details:
+        try:
+          info = detail.result(timeout=max(0, deadline - time.monotonic()))
+        except Exception:
+          info = None
+        if info and info['url'] not in seen: # the mirror repeats live hits
+          seen.add(info['url'])
+          yield info
+          count += 1
+          if count >= max_candidates:
+            return
+  finally:
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def local_tracks(items):
+  # (title, seconds) of every file, per disc; only the tag headers are read
+  discs = []
+  for key,files in sorted(items.items()):
+    disc = []
+    for filename in files:
+      try:
+        tags = peek_tags(filename, ('title',))
+      except Exception:
+        tags = {}
+      length = tags.get('~length', [None])[0] if '~length' in tags else \
+               getattr(getattr(tags, 'info', None), 'length', None)
+      disc.append((clean_orig((tags.get('title') or [''])[0]).lower(), length))
+    discs.append(disc)
+  return discs
+
+def similarity(a, b):
+  # the quick upper bounds skip most of the full comparisons
+  m = difflib.SequenceMatcher(None, a, b)
+  return m.ratio() if m.real_quick_ratio() > 0.3 and m.quick_ratio() > 0.3 \
+         else 0.0
+
+def confidence(search, album, local):
+  # how well does the candidate fit the search terms and the files on disk:
+  # the name, disc/track counts, then titles and lengths track by track
+  search = search.lower()
+  names  = (album.get('album_name_orig', ''), album.get('album_name_latin', ''))
+  scores = [(1, max(similarity(search, n.lower()) for n in names))]
+
+  found  = [disc.get('tracks', []) for disc in album.get('discs', [])]
+  counts = [len(disc) for disc in local]
+  total  = max(sum(counts), sum(len(d) for d in found), 1)
+  off    = sum(abs(a - b) for a,b in zip(counts, map(len, found))) + \
+           sum(counts[len(found):]) + sum(map(len, found[len(counts):]))
+  scores.append((1, (len(counts) == len(found)) * max(0, 1 - off / total)))
+
+  pairs  = [(mine, theirs) for disc, other in zip(local, found)
+                           for mine, theirs in zip(disc, other)
+  ]
+  titles = [max(similarity(mine[0], theirs.get('name', '').lower()),
+                similarity(mine[0], theirs.get('name_lat', '').lower())
+            ) for mine, theirs in pairs if mine[0]
+  ]
+  if titles:
+    scores.append((2, sum(titles) / len(titles)))
+  lengths = [max(0, 1 - abs(mine[1] - theirs['length']) / length_slack)
+             for mine, theirs in pairs if mine[1] and theirs.get('length')
+  ]
+  if lengths:
+    scores.append((2, sum(lengths) / len(lengths)))
+  return sum(w * v for w,v in scores) / sum(w for w,v in scores)
+
+@timed('search')
+def rank_candidates(search, items, local):
+  scored = [(confidence(search, info, local), info) for info in items]
+  return sorted(scored, key=lambda x: x[0], reverse=True)
+
+def search_album(search, files={}, ranked=None):
+  local = local_tracks(files)
+  while True:
+    if ranked is None:
+      ranked = rank_candidates(search, search_candidates(search), local)
+    items  = [info for score, info in ranked]
+    for index, (score, info) in enumerate(ranked):
+      print(f"{index} - {info['album_name_orig']} - {info['url']} ({score:.2f})")
+    if batch:
+      if not items:
+        return None
+      print(f'picked 0 (confidence {ranked[0][0]:.2f})')
+      return items[0] if ranked[0][0] >= min_confidence else None
+    if ranked and ranked[0][0] >= auto_accept and \
+       (len(ranked) == 1 or ranked[0][0] - ranked[1][0] >= auto_margin):
+      print(f'picked 0 (confidence {ranked[0][0]:.2f})')
+      return items[0]
+    while True:
+      search = read('enter index or new search terms [0]("-" for manual): ','0')
+      if not search:
+        if not items:
+          print('enter diffrent search terms please')
+          continue
+        return items[0]
+      elif search == '-':
+        return copy.deepcopy(default)
+      elif re.match('^\\d$', search):
+        index = int(search)
+        if index >= len(items):
+          continue
+        return items[index]
+      else:
+        ranked = None
+        break
+
+def scan_dir(dirname):
+  # one scandir pass, is_dir() comes from the cached d_type so nothing is
+  # stat'ed and no tags are read here
+  dirs, files = [], []
+  with os.scandir(dirname) as entries:
+    for entry in entries:
+      if entry.is_dir():
+        dirs.append(entry.name)
+      elif music_ext(entry.name):
+        files.append(entry.name)
+  return natsort.natsorted(dirs), natsort.natsorted(files)
+
+def sort_music_items(dirname, dirs, files):
+  items = {}
+  if is_disc(dirs):
+    index = 0
+    for disc in dirs:
+      discpath = os.path.join(dirname, disc)
+      if is_disc(disc):
+        index += 1
+        items[(index, discpath)] = [os.path.join(discpath, item)
+                                    for item in scan_dir(discpath)[1]
+        ]
+  else:
+    items[(1, dirname)] = [os.path.join(dirname, item) for item in files]
+  return items
+
+def album_search(dirname, items):
+  tmp_item   = peek_tags(list(items.values())[0][0],
+                         ('album', 'genre', 'albumartist', 'artist', 'date')
+  )
+  notes = []
+  if 'album' in tmp_item:
+    album_name = tmp_item['album'][0]
+  else: # untagged rips: see if they sound like something already tagged
+    album_name, notes = identify_album(items)
+    album_name = album_name or dirname
+  return tmp_item, album_name, notes
+
+def prefetch_album(dirname, items):
+  # everything get_album_info can do before it has to ask: the tags, the
+  # ranked candidates and the best one's cover
+  if not force and is_indexed(dirname, items):
+    return None
+  tmp_item, album_name, notes = album_search(dirname, items)
+  ranked = rank_candidates(album_name, search_candidates(album_name),
+                           local_tracks(items)
+  )
+  if ranked:
+    fetch_image(ranked[0][1].get('cover'))
+    fetch_image(ranked[0][1].get('thumb'))
+  return tmp_item, album_name, notes, ranked
+
+def prefetch_albums(paths, recursive=False, ahead=None):
+  # looks the next albums up on a thread while the current one is being
+  # edited; yields (path, items, prefetched), items is None for songs
+  work = queue.Queue(ahead or prefetch_ahead)
+  stop = threading.Event()
+
+  def put(item):
+    # gives up once the consumer has gone, nothing would take it
+    while not stop.is_set():
+      try:
+        work.put(item, timeout=0.2)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def run():
+    try:
+      for path in paths:
+        if not os.path.isdir(path):
+          if not put((path, None, None)):
+            return
+          continue
+        for dirname, items in find_albums(path, recursive):
+          if stop.is_set():
+            return
+          try:
+            prefetched = prefetch_album(dirname, items)
+          except Exception:
+            prefetched = None # process_album will try again and report it
+          if not put((dirname, items, prefetched)):
+            return
+    finally:
+      put(None)
+
+  thread = threading.Thread(target=run, daemon=True)
+  thread.start()
+  try:
+    while (item := work.get()) is not None:
+      yield item
+  finally:
+    stop.set()
+
+def get_album_info(dirname, items, prefetched=None):
+  #pdb.set_trace()
+  tmp_item, album_name, notes, ranked = prefetched or \
+                                        (*album_search(dirname, items), None)
+  for note in notes:
+    print(note)
+  album      = search_album(album_name, items, ranked)
+  if album is None:
+    return None
+  if not album.get('album_name_orig'):
+    album['album_name_orig'] = album_name
+  if not album.get('album_name_latin').strip():
+    name_lat = os.path.basename(os.path.realpath(dirname))
+    album['album_name_latin'] = clean_latin(name_lat).strip()
+  if not album.get('genres'):
+    album['genres'] = tmp_item.get('genre', [])
+  if not album.get('artists'):
+    album['artists'] = tmp_item.get('albumartist', tmp_item.get('artist', []))
+  if not album.get('date'):
+    album['date'] = tmp_item.get('date', [''])[0]
+  return album
+
+def user_modify_album(album):
+  print('\n\nModify album info(blank = default):')
+  keys = ['Original Name', 'Dirname', 'Artists', 'Cover', 'Date', 'Genres']
+  index = 0
+  new = ''
+  while index < len(keys):
+    key = keys[index].replace('Dirname', 'album_name_latin') \
+                     .replace('Original Name', 'album_name_orig').lower()
+    val = album.get(key, '')
+    if type(album[key]) == list:
+      val = '; '.join(val)
+    new = read(f"{keys[index]} [{val}]: ", val).strip()
+    if new == '^':
+      index -= 1
+      continue
+    if new:
+      if type(album[key]) == list:
+        new = re.split(r'\s*;\s*', new)
+      album[key] = new
+    index += 1
+  return album
+
+def keep_padding(info):
+  # if the new tag fits in the old one's padding only the tag is rewritten,
+  # otherwise the audio has to move anyway, so leave room for next time
+  return info.padding if info.padding >= 0 else tag_padding
+
+def commit_tags(f):
+  if type(f) == mutagen.easyid3.EasyID3:
+    f.save(v2_version=3, padding=keep_padding)
+  else:
+    f.save(padding=keep_padding)
+
+@timed('save_song')
+def save_song(f, info):
+  if type(f) == str:
+    f = open_tags(f)
+
+  f['title']               = info['title']
+  f['album']               = info['album_name_orig'].strip()
+  f['date']                = info.get('date',f.get('date',[''])[0]).strip()
+  f['artist']              = info['artist']
+  f['albumartist']         = info.get('album_artists', '').strip()
+  f['genre']               = info['genre']
+  f['comment']             = info['comment']
+  try:
+    f['tracktotal']        = str(info['num_songs'])
+    f['tracknumber']       = str(info['index'])
+  except:
+    f['tracknumber']       = f'{info["index"]:02}/{info["num_songs"]:02}'
+  try:
+    f['ctdbdiscconfidence']= f'{info["disc_num"]:02}/{info["num_discs"]:02}'
+  except:
+    f['discnumber']        = f'{info["disc_num"]:02}/{info["num_discs"]:02}'
+  for key, value in info.get('replaygain', {}).items():
+    f[key]                 = value
+  commit_tags(f)
+
+def process_song(filename, cover_data=None, album={}, info={}, discpath=None,
+                 replaygain=None):
+  f = open_tags(filename)
+
+  if not discpath:
+    discpath = os.path.dirname(os.path.realpath(filename))
+
+  ext = filename.rpartition('.')[2]
+
+  title    = (info.get('name', ''.join(f.get('title', [])))).strip()
+  name_lat = re.search(r'\d\d[ _\.-]*([^/]*)\.', os.path.basename(filename)) or ''
+  if name_lat:
+    name_lat = clean_latin(name_lat.group(1))
+  name_lat = info.get('name_lat', name_lat).strip()
+  artists  = '; '.join(album.get('artists') or f.get('artist', []))
+  genres   = '; '.join(album.get('genres')  or f.get('genre',  []))
+  comment  = ''
+
+  if type(f) == mutagen.easyid3.EasyID3:
+    id3 = f._EasyID3__id3
+    if 'COMM::XXX' in id3:
+      k = 'COMM::XXX'
+    else:
+      k = [k for k in id3.keys() if 'COMM' in k] or ['COMM']
+      k = k[0]
+    if k in id3:
+      comment = id3.get(k).text[0]
+  else:
+    comment = f.get('comment', [''])[0]
+
+  tmp = os.path.basename(filename)
+  tmp = re.search(r'^(\d+[ _\.-]+\s*)?(.*?)(\..{2,5})?$', tmp).group(2)
+  tmp = clean_latin(tmp)
+  name_lat = name_lat or tmp
+
+  info = {
+   'title'      : title,
+   'title latin': name_lat,
+   'artist'     : '; '.join(info.get('artists',f.get('artist')or[]))or artists,
+   'genre'      : genres,
+   'comment'    : comment,
+   'index'      : info.get('index',     1),
+   'num_songs'  : info.get('num_songs', 1),
+   'disc_num'   : info.get('disc_num',  1),
+   'num_discs'  : info.get('num_discs', 1)
+  }
+
+  print(
+  '\n\nTrack {disc_num:02}/{num_discs:02} - {index:02}/{num_songs:02}:'.format(
+    **info
+  ))
+
+  keys = ('Title', 'Title Latin', 'Artist', 'Genre', 'Comment')
+  item_index = 0
+  while item_index < len(keys):
+    item  = keys[item_index].lower()
+    value = info[item]
+    value = read(f' {keys[item_index]} [{value}]: ', value).strip()
+    if value == '^':
+      if item_index == 0:
+        return None
+      else:
+        item_index -= 1
+        continue
+    info[item] = value
+    item_index += 1
+
+  info.update(
+    {
+      'album_name_orig' : album.get('album_name_orig', ''),
+      'album_artists'   : artists,
+      'date'            : album.get('date', '1970-01-01'),
+      'replaygain'      : replaygain or {}
+    }
+  )
+
+  name_lat = re.sub(r'\.+\s*$', '', info['title latin']).strip()
+  new_name = os.path.join(discpath, f'{info["index"]:02} - {name_lat}.{ext}')
+  if plan is not None:
+    # a track planned again after going back (^) keeps only the new answers
+    path    = os.path.abspath(filename)
+    plan[:] = [op for op in plan if path not in (op.get('path'), op.get('src'))]
+    plan_op('tags', path=filename, tags=info, image=plan_image(cover_data))
+    plan_op('rename', src=filename, dst=new_name)
+    return new_name
+
+  if cover_data:
+    add_pic(f, cover_data)
+  save_song(f, info)
+  with timer('rename'):
+    os.rename(filename, new_name)
+  written[new_name] = info
+
+  return new_name
+
+def scan_album(dirname):
+  return sort_music_items(dirname, *scan_dir(dirname))
+
+def lookup_album(dirname, items, prefetched=None):
+  album = get_album_info(dirname, items, prefetched)
+  if album is None:
+    return None, None
+
+  if album.get('notes', ''):
+    print('\n\nNotes:')
+    print(album.get('notes', ''))
+
+  album = user_modify_album(album)
+
+  # download everything write_album() needs now, it reads them from the store.
+  # the full cover is kept as folder.jpg, tracks get a scaled down copy of it
+  cover_data = fetch_image(album['cover'])
+  if not Image or not cover_data:
+    cover_data = fetch_image(album['thumb'])
+  cover_data = normalize_cover(cover_data)
+  for disc in album.get('discs', []):
+    fetch_image(disc.get('cover', ''))
+  return album, cover_data
+
+def write_album(dirname, items, album, cover_data):
+  global plan_album
+  plan_album = os.path.abspath(dirname)
+  num_discs  = len(items)
+  save_image(album['cover'], dirname)
+
+  items   = sorted(items.items(), key=lambda x: x[0][0])
+  index_1 = 0
+  gains   = album_gain([f for key, files in items for f in files])
+
+  while index_1 < num_discs:
+    (disc_num, discpath), files = items[index_1]
+    disc           = album.get('discs', [])
+    disc           = disc[disc_num-1] if len(disc) >= disc_num else {}
+    num_songs      = len(files)
+    disc['tracks'] = disc.get('tracks', [{}]*num_songs)
+
+    if disc.get('cover', '') and discpath != dirname:
+      #print(discpath)
+      save_image(disc.get('cover', ''), discpath)
+
+    index_1 += 1
+
+    index = 0
+    while index < min(len(files), len(disc['tracks']), num_songs):
+      info     = disc['tracks'][index]
+      filename = files[index]
+      index += 1
+      info.update(
+        {
+          'index'     : index,
+          'num_songs' : num_songs,
+          'disc_num'  : disc_num,
+          'num_discs' : num_discs
+        }
+      )
+      new_name = process_song(filename, cover_data, album, info, discpath,
+                              gains.get(filename)
+      )
+      if new_name:
+        if plan is None: # planned files keep their names until --apply
+          files[index-1] = new_name
+      else:
+        if index == 1 and index_1 > 1:
+          index_1 -= 1
+          disc = None
+          break
+        else:
+          index -= 2
+          if index < 0:
+            index = 0
+          continue
+
+  new_dirname = os.path.join(
+    os.path.abspath(os.path.join(dirname, os.pardir)),
+    re.sub('[ _-]+$', '',
+            re.sub('[ _-]+', '_', album['album_name_latin'].strip())
+    )
+  )
+  new_dirname = re.sub(r'\.+[_\s]*$', '', new_dirname).strip()
+  if plan is not None:
+    plan_op('album', src=dirname, dst=new_dirname, source=album.get('source'),
+            url=album.get('url'), image=plan_image(cover_data)
+    )
+    plan_album = None
+    return new_dirname
+  plan_album  = None
+
+  old_real    = os.path.realpath(dirname)
+  tagged      = {os.path.realpath(f): tags for f,tags in written.items()}
+  written.clear()
+  print(f'\nrenaming "{dirname}" -> "{new_dirname}"\n\n')
+  with timer('rename'):
+    os.rename(dirname, new_dirname)
+
+  new_real = os.path.realpath(new_dirname)
+  tagged   = {new_real + path[len(old_real):]: tags
+              for path,tags in tagged.items() if path.startswith(old_real)
+  }
+  index_album(new_dirname, tagged, album, cover_data)
+  return new_dirname
+
+def plan_image(data):
+  if not data:
+    return None
+  digest = hashlib.sha256(data).hexdigest()
+  plan_images.setdefault(digest, base64.b64encode(data).decode())
+  return digest
+
+def plan_op(op, **args):
+  for key in ('path', 'src', 'dst'):
+    if key in args:
+      args[key] = os.path.abspath(args[key])
+  args['op']    = op
+  args['id']    = plan[-1]['id'] + 1 if plan else 0
+  args['album'] = plan_album or os.path.dirname(args.get('path', args.get('src')))
+  plan.append(args)
+
+def save_plan(filename):
+  tmp = f'{filename}.tmp'
+  with open(tmp, 'w') as f:
+    json.dump({'images':plan_images, 'ops':plan}, f, ensure_ascii=False, indent=1)
+  os.replace(tmp, filename)
+
+def apply_plan(filename):
+  # one album at a time: images, then tags, then file renames and finally
+  # the directory; every finished op goes to the journal so a crashed run
+  # can pick up where it stopped
+  with open(filename) as f:
+    data = json.load(f)
+  journal = f'{filename}.done'
+  try:
+    with open(journal) as f:
+      done = {int(line) for line in f if line.strip()}
+  except FileNotFoundError:
+    done = set()
+
+  phases = ('image', 'tags', 'rename', 'album')
+  albums = list(dict.fromkeys(op['album'] for op in data['ops']))
+  ops    = sorted(data['ops'], key=lambda op: (albums.index(op['album']),
+                  phases.index(op['op']), op.get('path', op.get('src')))
+  )
+  images = lambda digest: base64.b64decode(data['images'][digest])
+  tagged = {} # path -> tags, for the library index
+
+  with open(journal, 'a') as log:
+    for op in ops:
+      if op['op'] == 'tags':
+        tagged[op['path']] = op['tags']
+      elif op['op'] == 'rename':
+        tagged[op['dst']] = tagged.pop(op['src'], {})
+
+      if op['id'] in done:
+        continue
+      if op['op'] == 'image':
+        if not os.path.exists(op['path']):
+          write_image(images(op['image']), op['path'])
+      elif op['op'] == 'tags':
+        if os.path.exists(op['path']):
+          f = open_tags(op['path'])
+          if op['image']:
+            add_pic(f, images(op['image']))
+          save_song(f, op['tags'])
+      elif op['op'] == 'rename':
+        if os.path.exists(op['src']):
+          os.rename(op['src'], op['dst'])
+      elif op['op'] == 'album':
+        if os.path.exists(op['src']):
+          print(f'renaming "{op["src"]}" -> "{op["dst"]}"')
+          os.rename(op['src'], op['dst'])
+        src   = os.path.join(op['src'], '')
+        files = {os.path.join(op['dst'], path[len(src):]): tagged.pop(path)
+                 for path in list(tagged) if path.startswith(src)
+        }
+        index_album(op['dst'], files, op, op['image'] and images(op['image']))
+      log.write(f'{op["id"]}\n')
+      log.flush()
+      os.fsync(log.fileno())
+  os.remove(journal)
+
+def process_album(dirname, items=None, prefetched=None):
+  print(os.path.realpath(dirname))
+
+  items = items or scan_album(dirname)
+  if not force and is_indexed(dirname, items):
+    print('unchanged since it was tagged, skipping (--force to retag)\n\n')
+    return True
+  album, cover_data = lookup_album(dirname, items, prefetched)
+  if album is None:
+    print('no confident match, queued for --review\n\n')
+    queue_review(dirname)
+    return False
+
+  write_album(dirname, items, album, cover_data)
+  return True
+
+def write_album_job(dirname, items, album, cover_data):
+  # write_album in a --jobs worker, its output and stats go back to the
+  # parent: workers come from the forkserver, not with the parent's stdout
+  out = io.StringIO()
+  with contextlib.redirect_stdout(out):
+    write_album(dirname, items, album, cover_data)
+  return out.getvalue(), take_stats()
+
+def init_worker(batch_mode, offline_mode, gain_mode, tracing):
+  global batch, offline, gain, gain_workers, trace, _cache_db, _library_db, \
+         _mirror_db, _session, _cache_total
+  trace        = [] if tracing else None
+  batch        = batch_mode
+  offline      = offline_mode
+  gain         = gain_mode
+  gain_workers = 1    # albums are already spread over the processes
+  _cache_db    = None # connections must not be shared with the parent
+  _cache_total = None
+  _library_db  = None
+  _mirror_db   = None
+  _session     = None
+
+def run_pipeline(roots, recursive=False, jobs=os.cpu_count()):
+  # scan -> lookups on threads -> tag writes on processes; the queues are
+  # bounded so a big library never gets far ahead of the slowest stage
+  found    = queue.Queue(lookup_workers * 2)
+  slots    = threading.Semaphore(jobs * 2)
+  lock     = threading.Lock()
+  progress = {'found':0, 'skipped':0, 'looked up':0, 'written':0, 'queued':0,
+              'done':False
+  }
+
+  def report(dirname, status):
+    with lock:
+      progress[status] += 1
+      total = progress['found'] if progress['done'] else f"{progress['found']}+"
+      print(f"[{progress['written']}/{total} written, "
+            f"{progress['skipped']} skipped, "
+            f"{progress['looked up']} looked up, {progress['queued']} queued]"
+            f" {status}: {dirname}"
+      )
+
+  def scan():
+    for root in roots:
+      for dirname, items in find_albums(root, recursive):
+        with lock:
+          progress['found'] += 1
+        if not force and is_indexed(dirname, items):
+          report(dirname, 'skipped')
+          continue
+        found.put((dirname, items))
+    with lock:
+      progress['done'] = True
+    for i in range(lookup_workers):
+      found.put(None)
+
+  def written(future, dirname):
+    slots.release()
+    if future.exception():
+      print(f'failed to tag "{dirname}": {future.exception()}')
+      queue_review(dirname)
+      report(dirname, 'queued')
+    else:
+      out, stats = future.result()
+      print(out, end='')
+      merge_stats(stats)
+      report(dirname, 'written')
+
+  def lookup(pool):
+    while True:
+      job = found.get()
+      if job is None:
+        return
+      dirname, items = job
+      try:
+        album, cover_data = lookup_album(dirname, items)
+      except Exception as e:
+        print(f'failed to look up "{dirname}": {e}')
+        album = None
+      if album is None:
+        queue_review(dirname)
+        report(dirname, 'queued')
+        continue
+      report(dirname, 'looked up')
+      slots.acquire()
+      future = pool.submit(write_album_job, dirname, items, album, cover_data)
+      future.add_done_callback(lambda f, d=dirname: written(f, d))
+
+  with process_pool(jobs, initializer=init_worker,
+                    initargs=(batch, offline, gain, trace is not None)
+  ) as pool:
+    threads = [threading.Thread(target=scan)]
+    threads += [threading.Thread(target=lookup, args=(pool,))
+                for i in range(lookup_workers)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+  return progress
+
+def list_album(dirname, items):
+  print(os.path.realpath(dirname))
+  for (disc, discpath), files in sorted(items.items()):
+    for filename in files:
+      tags = peek_tags(filename, ('album', 'artist', 'title', 'date'))
+      tags = ['; '.join(tags.get(key, []))
+              for key in ('artist', 'title', 'album', 'date')
+      ]
+      print('  {}: {} - {} ({}, {})'.format(os.path.relpath(filename, dirname),
+                                            *tags
+      ))
+
+def find_albums(root, recursive=True):
+  # depth first, an album is yielded as soon as its directory has been read
+  dirs, files = scan_dir(root)
+  if files or is_disc(dirs) or not recursive:
+    yield root, sort_music_items(root, dirs, files)
+    return
+  for name in dirs:
+    dirname = os.path.join(root, name)
+    if not os.path.islink(dirname):
+      yield from find_albums(dirname)
+
+def queue_review(dirname):
+  dirname = os.path.realpath(dirname)
+  if dirname in load_review():
+    return
+  os.makedirs(data_dir, exist_ok=True)
+  with open(review_file, 'a') as f:
+    f.write(dirname+'\n')
+
+def load_review():
+  try:
+    with open(review_file) as f:
+      return [line.rstrip('\n') for line in f if line.strip()]
+  except FileNotFoundError:
+    return []
+
+def save_review(dirnames):
+  os.makedirs(data_dir, exist_ok=True)
+  with open(review_file, 'w') as f:
+    f.writelines(d+'\n' for d in dirnames)
+
+def send_msg(f, **msg):
+  f.write(json.dumps(msg).encode()+b'\n')
+  f.flush()
+
+def recv_msg(f):
+  line = f.readline()
+  return json.loads(line) if line else None
+
+class RemoteIO(io.TextIOBase):
+  # the client's terminal, as stdin/stdout/stderr of a run in the daemon
+  def __init__(self, f, kind):
+    self.f    = f
+    self.kind = kind
+
+  def writable(self):
+    return True
+
+  def write(self, text):
+    send_msg(self.f, **{self.kind: text})
+    return len(text)
+
+  def ask(self, prompt, default):
+    # the client prompts with its own readline, defaults and all
+    send_msg(self.f, read=prompt, default=default)
+    msg = recv_msg(self.f)
+    if msg is None: # stop the run, not carry on with the defaults
+      raise ConnectionError('the client went away')
+    return msg.get('answer', default)
+
+def run_client(argv):
+  # hand the run to a --daemon, None when there is none to take it
+  try:
+    sock = socket.socket(socket.AF_UNIX)
+    sock.connect(daemon_sock)
+  except OSError:
+    return None
+  with sock, sock.makefile('rwb') as f:
+    send_msg(f, argv=argv, cwd=os.getcwd())
+    while msg := recv_msg(f):
+      if 'exit' in msg:
+        return msg['exit']
+      if 'read' in msg:
+        send_msg(f, answer=read(msg['read'], msg['default']))
+        continue
+      out = sys.stdout if 'out' in msg else sys.stderr
+      out.write(msg.get('out', msg.get('err')))
+      out.flush()
+  return 'the daemon went away'
+
+def serve_run(f):
+  # runs one after the other in this process, so they share the http
+  # sessions, database connections and memoized lookups
+  request = recv_msg(f)
+  if not request:
+    return
+  cwd   = os.getcwd()
+  stdin = sys.stdin
+  code  = 0
+  try:
+    os.chdir(request['cwd'])
+    sys.stdin = RemoteIO(f, 'in')
+    with contextlib.redirect_stdout(RemoteIO(f, 'out')), \
+         contextlib.redirect_stderr(RemoteIO(f, 'err')):
+      try:
+        code = main(request['argv'])
+      except SystemExit as e:
+        code = e.code
+        if isinstance(code, str):
+          print(code, file=sys.stderr)
+          code = 1
+      except Exception:
+        traceback.print_exc()
+        code = 1
+    send_msg(f, exit=code or 0)
+  finally:
+    sys.stdin = stdin
+    os.chdir(cwd)
+
+def serve_daemon():
+  with socket.socket(socket.AF_UNIX) as probe:
+    if probe.connect_ex(daemon_sock) == 0:
+      sys.exit(f'a daemon is already running on {daemon_sock}')
+  with contextlib.suppress(FileNotFoundError):
+    os.remove(daemon_sock)
+  os.makedirs(os.path.dirname(daemon_sock), exist_ok=True)
+  server = socket.socket(socket.AF_UNIX)
+  umask  = os.umask(0o077) # only for this user
+  try:
+    server.bind(daemon_sock)
+  finally:
+    os.umask(umask)
+  try:
+    server.listen()
+    # load what the first run would otherwise wait for
+    http_session()
+    cache_db()
+    library_db()
+    vgmdb()
+    natsort.natsorted([])
+    for module in (numpy, Image):
+      if module:
+        importlib.import_module(module.__name__)
+    print(f'waiting for runs on {daemon_sock}')
+    while True:
+      conn, _ = server.accept()
+      # the client going away only ends its own run
+      with conn, contextlib.suppress(OSError), conn.makefile('rwb') as f:
+        serve_run(f)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+    os.remove(daemon_sock)
+
+# what a run can change, every run a --daemon takes starts from here
+startup = {name: globals()[name] for name in (
+  'offline', 'batch', 'force', 'gain', 'plan', 'trace', 'vocadb_url',
+  'utaitedb_url', '_aliases'
+)}
+
+def main(argv=None):
+  global offline, batch, force, gain, plan, trace, vocadb_url, utaitedb_url
+  globals().update(startup)
+  artist_alias.cache_clear() # artists.json is read again, it may have changed
+  plan_images.clear()
+  timings.clear()
+  counters.clear()
+
+  parser = argparse.ArgumentParser(description='tag an album (looks up stuff in vgmdb)')
+  parser.add_argument('paths', nargs='*', metavar='path',
+                      help='album directories or song files'
+  )
+  parser.add_argument('--offline', action='store_true',
+                      help='only use cached lookups, never touch the network'
+  )
+  parser.add_argument('-b', '--batch', action='store_true',
+                      help='never prompt: pick the best match, keep defaults'
+  )
+  parser.add_argument('-r', '--recursive', action='store_true',
+                      help='tag every album found under the given directories'
+  )
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+                      help='tag albums in parallel (needs --batch)'
+  )
+  parser.add_argument('-l', '--list', action='store_true',
+                      help='only show the tags the albums already have'
+  )
+  parser.add_argument('-f', '--force', action='store_true',
+                      help='retag albums that have not changed since last time'
+  )
+  parser.add_argument('--plan', metavar='FILE',
+                      help='only look albums up, save the changes to FILE'
+  )
+  parser.add_argument('--apply', metavar='FILE',
+                      help='make the changes saved by --plan'
+  )
+  parser.add_argument('--review', action='store_true',
+                      help='tag the albums --batch was not confident about'
+  )
+  parser.add_argument('--import', nargs='+', metavar='FILE', dest='dumps',
+                      help='add vgmdb.info/vocadb album json to the local mirror'
+  )
+  parser.add_argument('--source', choices=('vocadb', 'utaitedb'),
+                      help='site the --import dumps come from (otherwise '
+                           'told apart by their thumbnails)'
+  )
+  parser.add_argument('--no-gain', action='store_true',
+                      help='do not write replaygain tags'
+  )
+  parser.add_argument('--stats', action='store_true',
+                      help='time every phase, count requests and cache hits, '
+                           'print a summary at the end'
+  )
+  parser.add_argument('--stats-json', metavar='FILE',
+                      help='save the --stats numbers as json'
+  )
+  parser.add_argument('--trace', metavar='FILE',
+                      help='save a chrome trace (chrome://tracing, perfetto)'
+  )
+  parser.add_argument('--profile', metavar='FILE',
+                      help='run under cProfile, save the stats to FILE'
+  )
+  parser.add_argument('--fingerprint', action='store_true',
+                      help='fingerprint tagged albums, to recognise untagged '
+                           'copies later (needs numpy and ffmpeg)'
+  )
+  parser.add_argument('--serve-mirror', type=int, metavar='PORT',
+                      help='answer vocadb api requests from the local mirror'
+  )
+  parser.add_argument('--vocadb-url', default=startup['vocadb_url'], metavar='URL',
+                      help='where to look vocadb up (e.g. a --serve-mirror)'
+  )
+  parser.add_argument('--utaitedb-url', default=startup['utaitedb_url'], metavar='URL',
+                      help='where to look utaitedb up'
+  )
+  parser.add_argument('--daemon', action='store_true',
+                      help='stay running and take the runs of later calls, '
+                           'which then start warm'
+  )
+  parser.add_argument('--no-daemon', action='store_true',
+                      help='run here even if a --daemon is running'
+  )
+  args    = parser.parse_args(argv)
+  offline = args.offline
+  batch   = args.batch
+  force   = args.force
+  gain    = not args.no_gain
+  vocadb_url   = args.vocadb_url
+  utaitedb_url = args.utaitedb_url
+  if args.jobs > 1 and not batch:
+    parser.error('--jobs needs --batch, prompts can not run in parallel')
+  if args.jobs > 1 and args.plan:
+    parser.error('--plan can not be used with --jobs')
+  if args.daemon:
+    serve_daemon()
+    return
+
+  with contextlib.ExitStack() as done:
+    if args.stats:
+      done.callback(print_stats)
+    if args.stats_json:
+      done.callback(save_stats, args.stats_json)
+    if args.trace:
+      trace = []
+      done.callback(save_trace, args.trace)
+    if args.profile:
+      profiler = cProfile.Profile()
+      profiler.enable()
+      done.callback(lambda: (profiler.disable(),
+                             profiler.dump_stats(args.profile))
+      )
+
+    if args.dumps:
+      import_mirror(args.dumps, args.source)
+    if args.fingerprint:
+      build_prints()
+    if args.serve_mirror is not None:
+      serve_mirror(args.serve_mirror)
+      return
+    if args.apply:
+      apply_plan(args.apply)
+      return
+    if args.plan:
+      plan = []
+      done.callback(save_plan, args.plan)
+
+    if args.review:
+      pending = load_review()
+      for dirname in list(pending):
+        if not os.path.isdir(dirname) or process_album(dirname):
+          pending.remove(dirname)
+          save_review(pending)
+
+    if args.list:
+      for dirname in [p for p in args.paths if os.path.isdir(p)]:
+        for album_dir, items in find_albums(dirname, args.recursive):
+          list_album(album_dir, items)
+      return
+
+    if args.jobs > 1:
+      for filename in [p for p in args.paths if not os.path.isdir(p)]:
+        process_song(filename)
+      run_pipeline([p for p in args.paths if os.path.isdir(p)],
+                   args.recursive, args.jobs
+      )
+      return
+
+    for album_dir, items, prefetched in prefetch_albums(args.paths,
+                                                       args.recursive):
+      if items is None:
+        process_song(album_dir)
+        continue
+      try:
+        process_album(album_dir, items, prefetched)
+      except Exception as e:
+        if not batch:
+          raise
+        print(f'failed to tag "{album_dir}": {e}, queued for --review\n\n')
+        queue_review(album_dir)
+
+def run(argv):
+  # music-tag.py, hands the run to a --daemon when there is one
+  if not {'--daemon', '--no-daemon'} & set(argv):
+    code = run_client(argv)
+    if code is not None:
+      return code
+  return main(argv)
+
+if __name__ == '__main__':
+  sys.exit(run(sys.argv[1:]))